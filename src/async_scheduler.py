@@ -1,22 +1,41 @@
 from __future__ import annotations
+import os
+import time
+import logging
+import codecs
+import signal
 import asyncio
 import threading
 import functools
-from queue import Queue
+import importlib.util
+from queue import Empty
 from types import TracebackType
-from typing import Callable, Type, Optional
+from typing import Callable, Type, Optional, TYPE_CHECKING
 from concurrent.futures import ThreadPoolExecutor
-import aiohttp
-import aiofiles
-from tqdm import tqdm
-from fake_useragent import UserAgent
 from config import config
-from proxy_pool import ProxyPool
-from logger import logger, INFO
+from records import Task
+from fair_queue import FairQueue, Job
+from user_agents import random_user_agent
+from traffic_archive import TrafficRecorder, TrafficArchive, ReplaySession
+from process_engine import ProcessEngine
+from logger import logger, init_logger, INFO
+
+if TYPE_CHECKING:
+    # aiohttp, aiofiles and tqdm are imported when they are used, importing the scheduler stays cheap
+    import aiohttp
+    from proxy_pool import ProxyPool
+
+
+# characters of the previous chunks given again to until(), longer than the markers it looks for
+UNTIL_OVERLAP = 256
+
+
+class ResponseTooLarge(Exception):
+    pass
 
 
 class AsyncScheduler:
-    def __init__(self, proxy_pool:ProxyPool=None) -> None:
+    def __init__(self, proxy_pool:ProxyPool=None, record_path:str=None, replay_path:str=None, replay_speed:float=None) -> None:
         logger.info('init async scheduler...')
         logger.debug('get scheduler config')
         self.scheduler_config = config.get("scheduler")
@@ -24,25 +43,69 @@ class AsyncScheduler:
         self.max_retries = self.scheduler_config["max_retries"]
         self.timeout = self.scheduler_config["timeout"]
         self.failed_urls_path = self.scheduler_config["failed_urls_path"]
-
-        logger.debug('set proxy pool and user agent')
+        self.max_body_size = self.scheduler_config.get("max_body_size", 10 * 1024 * 1024)
+        self.chunk_size = self.scheduler_config.get("chunk_size", 16 * 1024)
+        self.default_charset = self.scheduler_config.get("default_charset", "utf-8")
+        # aiohttp decodes br only when brotli is installed
+        self.accept_encoding = 'gzip, deflate, br' if importlib.util.find_spec('brotli') else 'gzip, deflate'
+        self.drain_timeout = self.scheduler_config.get("drain_timeout", 30)
+
+        logger.debug('set engine')
+        # thread: num_threads event loops in this process, process: one event loop per core in worker processes
+        self.engine_name = self.scheduler_config.get("engine", "thread")
+        self.num_processes = self.scheduler_config.get("num_processes", 0) or os.cpu_count()
+        self.process_concurrency = self.scheduler_config.get("process_concurrency", 8)
+        self.use_uvloop = self.scheduler_config.get("use_uvloop", False)
+        if self.use_uvloop and not importlib.util.find_spec('uvloop'):
+            logger.warning("uvloop is not installed, use the asyncio event loop")
+            self.use_uvloop = False
+        self.engine = None
+
+        logger.debug('set record and replay')
+        # record_path: save the responses to a traffic archive, replay_path: serve the responses from one
+        self.record_path = record_path if record_path else self.scheduler_config.get("record_path")
+        self.replay_path = replay_path if replay_path else self.scheduler_config.get("replay_path")
+        self.replay_speed = replay_speed if replay_speed is not None else self.scheduler_config.get("replay_speed", 0)
+        self.recorder = None
+        self.archive = None
+        if self.replay_path:
+            # the archive gives the same answer every time
+            self.max_retries = 1
+
+        logger.debug('set proxy pool')
         self.proxy_pool = proxy_pool
         self.proxy_auth = proxy_pool.get_proxy_auth if proxy_pool else None
-        self.user_agent = UserAgent()
         
-        logger.debug('create progress_bar')
-        self.process_lock = threading.Lock()
-        self.progress_bar = tqdm(total=0)
-
         logger.debug('create queue and executor')
-        self.tasks_queue = Queue()
+        # every crawler is a job on the queue with its own progress bar and join()
+        self.tasks_queue = FairQueue()
+        self.default_job = self.tasks_queue.default_job
         self.executor = ThreadPoolExecutor(max_workers=self.num_threads)
         self.running = True
+
+        logger.debug('create shutdown state')
+        # set by shutdown(), tasks which are not finished are moved to pending_tasks
+        self.interrupted = False
+        self.received_signal = None
+        # set by a second signal: in-flight requests are cancelled at once and stop() exits the process
+        self.force_exit = False
+        self.pending_lock = threading.Lock()
+        self.pending_tasks = []
+        # task -> (future, loop) of the requests running in the worker threads
+        self.in_flight = {}
+
+        logger.debug('create progress_bar')
+        self.process_lock = threading.Lock()
+        # tasks whose response was fetched, the cancelled and failed ones are not counted
+        self.fetched_count = 0
+        self.reset_progress_bar()
         logger.info('init async scheduler finish!')
 
 
     @staticmethod
     def get_function_name(func):
+        if func is None:
+            return None
         if isinstance(func, functools.partial):
             return func.func.__name__
         else:
@@ -58,118 +121,394 @@ class AsyncScheduler:
     
 
     async def save_failed_url(self, url:str, resp_handler:Callable[[str], None]=None) -> None:
+        import aiofiles
         async with aiofiles.open(self.failed_urls_path, mode='a') as file:
             await file.write(f'url={str(url)}, resp_handler=[{AsyncScheduler.get_function_name(resp_handler)}]{resp_handler}\n')
 
 
-    async def fetch(self, session:aiohttp.ClientSession, url:str, resp_handler:Callable[[str], None]=None) -> str | None:
-        # async with aiohttp.ClientSession() as session:
+    async def read_body(self, response:aiohttp.ClientResponse, until:Callable[[str], bool]=None, raw:bytearray=None) -> str:
+        '''
+        read the (already decompressed) body chunk by chunk and decode it with the declared charset.
+        until(window) gets the new text of every chunk with the last UNTIL_OVERLAP characters before it,
+        so a marker split between two chunks is still seen, if it returns True the rest of the body
+        is not downloaded and the connection is closed.
+        the bytes read are appended to raw if it is given.
+        '''
+        if response.content_length is not None and response.content_length > self.max_body_size:
+            raise ResponseTooLarge(f"content-length={response.content_length} > max_body_size={self.max_body_size}")
+
+        charset = response.charset or self.default_charset
+        try:
+            decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+        except LookupError:
+            logger.warning(f"unknown charset={charset}, url={response.url}, decode with {self.default_charset}")
+            decoder = codecs.getincrementaldecoder(self.default_charset)(errors='replace')
+
+        size = 0
+        parts = []
+        tail = ''
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            size += len(chunk)
+            if size > self.max_body_size:
+                raise ResponseTooLarge(f"body size > max_body_size={self.max_body_size}")
+            piece = decoder.decode(chunk)
+            parts.append(piece)
+            if raw is not None:
+                raw += chunk
+            if until:
+                window = tail + piece
+                if until(window):
+                    logger.debug(f"url={response.url} stop reading after {size} bytes")
+                    response.close()
+                    return ''.join(parts)
+                tail = window[-UNTIL_OVERLAP:]
+
+        parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts)
+
+
+    async def fetch(self, session:aiohttp.ClientSession, url:str, resp_handler:Callable[[str], None]=None,
+                    proxy_pool:ProxyPool=None) -> str | None:
+        '''proxy_pool replaces the pool of the scheduler, the process engine gives the proxies picked in the parent'''
+        proxy_pool = proxy_pool if proxy_pool else self.proxy_pool
+        until = getattr(resp_handler, 'until', None)
         for _ in range(self.max_retries):
             try:
                 logger.debug(f"url={url} start request, i={_}")
-                proxy = self.proxy_pool.get_one_proxy() if self.proxy_pool else None
+                proxy = proxy_pool.get_one_proxy() if proxy_pool else None
                 headers = {
-                    'User-Agent': self.user_agent.random
+                    'User-Agent': random_user_agent(),
+                    'Accept-Encoding': self.accept_encoding
                 }
+                start_time = time.monotonic()
                 async with session.get(
                                         url=url, headers=headers,
                                         proxy=f'http://{proxy}/' if proxy else None, proxy_auth=self.proxy_auth,
                                         timeout=self.timeout
                                         ) as response:
-                    resp = await response.read()
                     if response.status == 200:
-                        result = resp.decode('utf-8')
+                        raw = bytearray() if self.recorder else None
+                        result = await self.read_body(response, until, raw)
+                        if self.recorder:
+                            self.recorder.record(url, response.status, response.charset, bytes(raw), time.monotonic() - start_time)
                         if resp_handler:
                             logger.debug(f"handler={resp_handler} url={url} success!")
                             resp_handler(result)
                         
-                        self.progress_bar.update(1)
                         logger.debug(f"url={url} success!")
                         return result
-                    
+
+                    if self.archive:
+                        # not in the archive, there is nothing to wait for and no other answer to get
+                        logger.debug(f"url={url} replay miss, status={response.status}")
+                        break
                     raise Exception(f"response error! status={response.status}")
+
+            except ResponseTooLarge as e:
+                logger.error(f"exception: {e}, url: {url}")
+                break
                 
             except Exception as e:
                 logger.error(f"exception: {e}, url: {url}", exc_info=True, stack_info=True)
-                if self.proxy_pool:
-                    self.proxy_pool.proxy_error_cnt(proxy_ip=proxy)
+                if proxy_pool:
+                    proxy_pool.proxy_error_cnt(proxy_ip=proxy)
                 await asyncio.sleep(1)
             finally:
                 pass
 
+        fail = getattr(resp_handler, 'fail', None)
+        if fail:
+            try:
+                fail()
+            except Exception as e:
+                logger.error(f"on_failure exception: {e}, url: {url}", exc_info=True)
         await self.save_failed_url(url=url, resp_handler=resp_handler)
-        self.progress_bar.update(1)
         logger.error(f"url={url} attempts exceeded the limit!")
         return None
 
 
+    def new_session(self) -> aiohttp.ClientSession | ReplaySession:
+        if self.archive:
+            return ReplaySession(self.archive, self.replay_speed)
+        import aiohttp
+        return aiohttp.ClientSession()
+
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        if self.use_uvloop:
+            import uvloop
+            return uvloop.new_event_loop()
+        return asyncio.new_event_loop()
+
+
     async def worker(self, loop:asyncio.AbstractEventLoop) -> None:
-        async with aiohttp.ClientSession() as session:
+        async with self.new_session() as session:
             while True:
                 task = await loop.run_in_executor(None, self.tasks_queue.get)
                 logger.debug(f"get task={task} from queue")
-                if task == (None, None):
+                if task is None:
                     logger.debug(f"task is None, break running loop")
                     self.tasks_queue.task_done()
                     break
-                url, response_handler = task
-                await self.fetch(session, url, response_handler)
-                self.tasks_queue.task_done()
+                if self.interrupted:
+                    self.keep_pending(task)
+                    self.tasks_queue.task_done(task.job)
+                    continue
+                if task.cancelled:
+                    logger.debug(f"task={task} cancelled before start")
+                    self.update_progress(task.job, fetched=False)
+                    self.tasks_queue.task_done(task.job)
+                    continue
+
+                future = asyncio.ensure_future(self.fetch(session, task.url, task if task.handler else None))
+                self.in_flight[task] = (future, loop)
+                if task.cancelled:
+                    # cancel_task() came between the check above and now
+                    future.cancel()
+                try:
+                    result = await future
+                    self.update_progress(task.job, fetched=result is not None)
+                except asyncio.CancelledError:
+                    if task.cancelled:
+                        # not needed any more, e.g. a page after the end of its list
+                        logger.debug(f"task={task} cancelled while running")
+                        self.update_progress(task.job, fetched=False)
+                    else:
+                        logger.debug(f"task={task} cancelled by shutdown")
+                        self.keep_pending(task)
+                finally:
+                    self.in_flight.pop(task, None)
+                    self.tasks_queue.task_done(task.job)
 
         logger.debug(f"exit worker")
 
 
     def start_worker(self) -> None:
         logger.debug(f"start worker")
-        loop = asyncio.new_event_loop()
+        loop = self.new_event_loop()
         asyncio.set_event_loop(loop)
-        loop.run_until_complete(self.worker(loop))
+        try:
+            loop.run_until_complete(self.worker(loop))
+        finally:
+            loop.close()
 
 
     def start(self) -> None:
         logger.info(f"start scheduler")
+        if self.replay_path and self.archive is None:
+            self.archive = TrafficArchive(self.replay_path)
+        if self.engine_name == "process":
+            import multiprocessing
+            if "fork" not in multiprocessing.get_all_start_methods():
+                logger.warning("the process engine needs the fork start method, use the thread engine")
+                self.engine_name = "thread"
+        if self.engine_name == "process":
+            if self.record_path:
+                # the worker processes would write to copies of the same file
+                logger.warning("recording is not supported by the process engine, record_path is ignored")
+                self.record_path = None
+            if self.engine is None:
+                self.engine = ProcessEngine(self, self.num_processes, self.process_concurrency)
+                self.engine.start()
+            return
+
+        if self.record_path and self.recorder is None:
+            self.recorder = TrafficRecorder(self.record_path)
         for _ in range(self.num_threads):
             logger.debug(f"executor submit {_}")
             self.executor.submit(self.start_worker)
 
 
-    def add_task(self, url:str, resp_handler:Callable[[str], None]=None) -> None:
-        logger.debug(f"add task task:url={url}, resp_handler=[{AsyncScheduler.get_function_name(resp_handler)}]{resp_handler}")
-        self.tasks_queue.put((url, resp_handler))
-        self.progress_bar.total += 1
+    def create_job(self, name:str, weight:float=1) -> Job:
+        logger.info(f"create job={name}, weight={weight}")
+        job = self.tasks_queue.create_job(name, weight)
+        self.reset_progress_bar(job)
+        return job
+
+
+    def add_task(self, url:str | Task, resp_handler:Callable[[str], None]=None, job:Job=None) -> None:
+        task = url if isinstance(url, Task) else Task(url, resp_handler)
+        if job:
+            task.job = job
+        if task.job is None:
+            task.job = self.default_job
+        logger.debug(f"add task task:url={task.url}, resp_handler=[{AsyncScheduler.get_function_name(task.handler)}]{task.handler}, job={task.job.name}")
+        if self.interrupted:
+            self.keep_pending(task)
+            return
+        with self.process_lock:
+            task.job.progress_bar.total += 1
+        self.tasks_queue.put(task, task.job)
 
 
-    def add_tasks(self, tasks:list[tuple[str, Callable[[str], None] | None]]) -> None:
+    def add_tasks(self, tasks:list[Task | tuple[str, Callable[[str], None] | None]], job:Job=None) -> None:
         for task in tasks:
-            self.add_task(*task)
+            if isinstance(task, Task):
+                self.add_task(task, job=job)
+            else:
+                self.add_task(*task, job=job)
 
     
-    def reset_progress_bar(self) -> None:
-        logger.debug('resetting progress bar...')
-        self.progress_bar.close()
-        self.progress_bar = tqdm(total=0)
+    def update_progress(self, job:Job=None, fetched:bool=True) -> None:
+        job = job if job else self.default_job
+        with self.process_lock:
+            if fetched:
+                self.fetched_count += 1
+            job.progress_bar.update(1)
+
+
+    def reset_progress_bar(self, job:Job=None) -> None:
+        job = job if job else self.default_job
+        logger.debug(f'resetting progress bar of job={job.name}...')
+        from tqdm import tqdm
+        with self.process_lock:
+            if job.progress_bar is not None:
+                job.progress_bar.close()
+            job.progress_bar = tqdm(total=0, desc=job.name, position=self.tasks_queue.jobs.index(job))
         logger.debug('progress bar reset successfully')
 
 
+    @property
+    def progress_bar(self):
+        return self.default_job.progress_bar
+
+
     def running_status(self) -> bool:
         return self.running
 
         
-    def join(self) -> None:
-        self.tasks_queue.join()
+    def join(self, job:Job=None) -> None:
+        '''wait for the tasks of job, or for all the tasks'''
+        if job:
+            job.join()
+        else:
+            self.tasks_queue.join()
+
+
+    def cancel_task(self, task:Task) -> None:
+        '''
+        a queued task is skipped by the workers, a running request is cancelled in its event loop.
+        either way the task is finished, it is not kept in pending_tasks.
+        '''
+        task.cancel()
+        if self.engine:
+            self.engine.cancel_task(task)
+            return
+        entry = self.in_flight.get(task)
+        if entry:
+            future, loop = entry
+            loop.call_soon_threadsafe(future.cancel)
+
+
+    def keep_pending(self, task:Task) -> None:
+        with self.pending_lock:
+            self.pending_tasks.append(task)
+
+
+    def take_pending_tasks(self, owner:object=None) -> list[Task]:
+        '''remove and return the unfinished tasks (of the handlers bound to owner) after shutdown'''
+        tasks, others = [], []
+        with self.pending_lock:
+            for task in self.pending_tasks:
+                if owner is None or getattr(task.handler, '__self__', None) is owner:
+                    tasks.append(task)
+                else:
+                    others.append(task)
+            self.pending_tasks = others
+        return tasks
+
+
+    def install_signal_handlers(self) -> None:
+        '''must be called from the main thread'''
+        logger.debug('install SIGINT and SIGTERM handlers')
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.handle_signal)
+
+
+    def handle_signal(self, signum:int, frame) -> None:
+        if self.force_exit:
+            logger.warning(f"received signal={signum} a third time, exit without checkpoint")
+            if self.engine:
+                self.engine.kill()
+            logging.shutdown()
+            os._exit(128 + signum)
+        if self.interrupted:
+            # the crawlers still save their checkpoints when join() returns, stop() then exits
+            logger.warning(f"received signal={signum} again, cancel in-flight tasks and exit")
+            self.force_exit = True
+            return
+        logger.warning(f"received signal={signum}, shutdown in {self.drain_timeout}s")
+        self.received_signal = signum
+        # join() is waiting in the main thread, so drain in another one
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+    def shutdown(self, drain_timeout:float=None) -> None:
+        '''
+        stop taking tasks: queued tasks are moved to pending_tasks at once,
+        in-flight requests get drain_timeout seconds to finish and are cancelled after that.
+        join() returns when all of them are done, the crawlers then save results and checkpoints.
+        '''
+        drain_timeout = self.drain_timeout if drain_timeout is None else drain_timeout
+        logger.info(f"shutdown scheduler, drain_timeout={drain_timeout}")
+        self.interrupted = True
+
+        logger.debug("move queued tasks to pending")
+        while True:
+            try:
+                task = self.tasks_queue.get_nowait()
+            except Empty:
+                break
+            if task is None:
+                # keep the stop sentinels for the workers
+                self.tasks_queue.task_done()
+                self.tasks_queue.put(None)
+                break
+            self.keep_pending(task)
+            self.tasks_queue.task_done(task.job)
+
+        in_flight_count = self.engine.in_flight_count if self.engine else lambda: len(self.in_flight)
+        logger.debug(f"wait for {in_flight_count()} in-flight tasks")
+        deadline = time.monotonic() + drain_timeout
+        while in_flight_count() and time.monotonic() < deadline and not self.force_exit:
+            time.sleep(0.1)
+
+        if self.engine:
+            cancelled = self.engine.cancel_in_flight()
+        else:
+            cancelled = len(self.in_flight)
+            for future, loop in list(self.in_flight.values()):
+                loop.call_soon_threadsafe(future.cancel)
+        logger.info(f"shutdown scheduler success, cancelled={cancelled}, pending={len(self.pending_tasks)}")
 
 
     def stop(self) -> None:
+        if self.force_exit:
+            # the checkpoints are saved, do not wait for the workers and the worker processes
+            logger.warning(f"force exit, pending={len(self.pending_tasks)}")
+            if self.engine:
+                self.engine.kill()
+            if self.recorder:
+                self.recorder.close()
+            logging.shutdown()
+            os._exit(128 + (self.received_signal or 0))
         logger.info(f"stop scheduler...")
         self.running = False
         logger.debug(f"send None to threads")
-        for _ in range(self.num_threads):
-            self.tasks_queue.put((None, None))
+        # the process engine has one consumer, its feeder thread
+        for _ in range(1 if self.engine else self.num_threads):
+            self.tasks_queue.put(None)
         
         logger.debug(f"wait for all tasks to be completed")
         self.tasks_queue.join()
-        self.progress_bar.close()
+        if self.engine:
+            self.engine.stop()
+        for job in self.tasks_queue.jobs:
+            if job.progress_bar is not None:
+                job.progress_bar.close()
         self.executor.shutdown(wait=True)
+        if self.recorder:
+            self.recorder.close()
         logger.info(f"stop scheduler success!")
 
 
@@ -188,6 +527,7 @@ class AsyncScheduler:
 
 
 if __name__ == "__main__":
+    init_logger()
     logger.setLevel(INFO)
     results_lock = threading.Lock()
     results = []
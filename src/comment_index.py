@@ -0,0 +1,399 @@
+'''
+On-disk inverted index over the crawled comments, filled by the crawlers while the comments arrive.
+
+Texts are tokenized with jieba (cut_for_search) when it is installed, otherwise with character bigrams
+of the Chinese runs plus the latin/digit words, so no outside service is needed.
+The tokenizer of an index is saved in its meta.json and kept across runs.
+
+New documents are indexed in memory and written as an immutable run every flush_docs documents
+(runs/run_xxxxx.lex: {term: [offset, count]}, runs/run_xxxxx.post: uint32 doc ids).
+When there are more than max_runs runs they are merged into one; meta.json lists the live runs
+and is replaced atomically, so an interrupted flush or merge leaves the previous index.
+The documents (record fields, the long comment texts stay in the SegmentStore) are in docs.jsonl
+with their offsets in docs.offsets, a query only reads the postings of its terms and the matching documents.
+
+usage: python comment_index.py <query> [short|long] [config.json]
+'''
+from __future__ import annotations
+import os
+import re
+import sys
+import json
+import threading
+import importlib.util
+from array import array
+from collections import defaultdict
+from types import TracebackType
+from typing import Type, Optional
+from records import Record, RECORD_TYPES
+from segment_store import SegmentStore
+from config import config
+from logger import logger, init_logger, INFO
+
+CJK_RUN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+')
+WORD = re.compile(r'[a-z0-9]+')
+HAS_WORD_CHAR = re.compile(r'\w')
+
+
+class BigramTokenizer:
+    name = "bigram"
+    n = 2
+
+    def tokens(self, text:str) -> set[str]:
+        text = text.lower()
+        tokens = set(WORD.findall(text))
+        for run in CJK_RUN.findall(text):
+            if len(run) < self.n:
+                tokens.add(run)
+            else:
+                tokens.update(run[i:i + self.n] for i in range(len(run) - self.n + 1))
+        return tokens
+
+
+    def query(self, text:str) -> set[str]:
+        return self.tokens(text)
+
+
+class JiebaTokenizer:
+    name = "jieba"
+
+    def tokens(self, text:str) -> set[str]:
+        import jieba
+        return {_.strip().lower() for _ in jieba.cut_for_search(text) if HAS_WORD_CHAR.search(_)}
+
+
+    def query(self, text:str) -> set[str]:
+        # the words of the precise mode are among the search mode tokens of the documents
+        import jieba
+        return {_.strip().lower() for _ in jieba.cut(text) if HAS_WORD_CHAR.search(_)}
+
+
+TOKENIZERS = {"bigram": BigramTokenizer, "jieba": JiebaTokenizer}
+
+
+class CommentIndex:
+    '''
+    text_field is the indexed field of the records, key_fields identify a record so that
+    the comments fetched again on a rerun are not indexed twice.
+    with store_text=False the text is not copied to docs.jsonl, search() gets it from text_store.
+    '''
+
+    def __init__(self, path:str, text_field:str, key_fields:tuple[str, ...], store_text:bool=True,
+                 tokenizer:str=None, flush_docs:int=10000, max_runs:int=8) -> None:
+        logger.info(f'open comment index at {path}')
+        self.path = path
+        self.runs_path = os.path.join(path, "runs")
+        self.text_field = text_field
+        self.key_fields = key_fields
+        self.store_text = store_text
+        self.flush_docs = flush_docs
+        self.max_runs = max_runs
+        self.lock = threading.Lock()
+        os.makedirs(self.runs_path, exist_ok=True)
+
+        self.meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f_obj:
+                self.meta = json.load(f_obj)
+        else:
+            if tokenizer is None:
+                tokenizer = "jieba" if importlib.util.find_spec('jieba') else "bigram"
+            self.meta = {"tokenizer": tokenizer, "doc_count": 0, "runs": [], "next_run": 0}
+        self.tokenizer = TOKENIZERS[self.meta["tokenizer"]]()
+
+        self.load_docs()
+        # run name -> (lexicon, postings file)
+        self.runs = {}
+        for run in self.meta["runs"]:
+            self.open_run(run)
+
+        # documents added since the last flush, their ids start at doc_count
+        self.pending_docs = []
+        self.pending_postings = defaultdict(list)
+        logger.info(f'open comment index finish, tokenizer={self.tokenizer.name}, docs={self.meta["doc_count"]}, runs={len(self.runs)}')
+
+
+    def load_docs(self) -> None:
+        '''the doc offsets and keys, the documents written after the last saved meta.json are dropped'''
+        doc_count = self.meta["doc_count"]
+        self.offsets = array('Q')
+        offsets_path = os.path.join(self.path, "docs.offsets")
+        if os.path.exists(offsets_path):
+            with open(offsets_path, 'rb') as f_obj:
+                self.offsets.frombytes(f_obj.read(doc_count * self.offsets.itemsize))
+            os.truncate(offsets_path, doc_count * self.offsets.itemsize)
+
+        docs_path = os.path.join(self.path, "docs.jsonl")
+        if os.path.exists(docs_path):
+            with open(docs_path, 'rb') as f_obj:
+                if doc_count:
+                    f_obj.seek(self.offsets[-1])
+                    f_obj.readline()
+                end = f_obj.tell()
+            os.truncate(docs_path, end)
+
+        self.doc_keys = set()
+        keys_path = os.path.join(self.path, "docs.keys")
+        if os.path.exists(keys_path):
+            with open(keys_path, 'r', encoding='utf-8') as f_obj:
+                keys = f_obj.read().splitlines()
+            if len(keys) > doc_count:
+                keys = keys[:doc_count]
+                with open(keys_path, 'w', encoding='utf-8') as f_obj:
+                    f_obj.writelines(_ + '\n' for _ in keys)
+            # the empty lines are the documents indexed without a key
+            self.doc_keys.update(_ for _ in keys if _)
+
+        self.docs_file = open(docs_path, 'ab')
+        self.offsets_file = open(offsets_path, 'ab')
+        self.keys_file = open(keys_path, 'a', encoding='utf-8')
+        self.docs_reader = open(docs_path, 'rb')
+
+
+    def run_file_path(self, run:str, extension:str) -> str:
+        return os.path.join(self.runs_path, f"{run}.{extension}")
+
+
+    def open_run(self, run:str) -> None:
+        with open(self.run_file_path(run, "lex"), 'r', encoding='utf-8') as f_obj:
+            lexicon = json.load(f_obj)
+        self.runs[run] = (lexicon, open(self.run_file_path(run, "post"), 'rb'))
+
+
+    def record_key(self, record:Record) -> str | None:
+        '''None when a key field is missing, such a record is always indexed'''
+        values = [getattr(record, _) for _ in self.key_fields]
+        if any(_ is None for _ in values):
+            return None
+        return '\t'.join(map(str, values))
+
+
+    def add(self, record:Record) -> bool:
+        '''index a record, returns False when it is already indexed'''
+        key = self.record_key(record)
+        text = getattr(record, self.text_field) or ''
+        doc = record.to_dict()
+        if not self.store_text:
+            del doc[self.text_field]
+        doc["type"] = record.__class__.__name__
+
+        tokens = self.tokenizer.tokens(text)
+        with self.lock:
+            if key is not None:
+                if key in self.doc_keys:
+                    return False
+                self.doc_keys.add(key)
+            doc_id = self.meta["doc_count"] + len(self.pending_docs)
+            self.pending_docs.append((key, doc))
+            for token in tokens:
+                self.pending_postings[token].append(doc_id)
+            if len(self.pending_docs) >= self.flush_docs:
+                self.flush_unlocked()
+        return True
+
+
+    def add_many(self, records:list[Record]) -> int:
+        return sum(self.add(_) for _ in records)
+
+
+    def write_run(self, postings:dict[str, array | list[int]]) -> str:
+        run = f"run_{self.meta['next_run']:05d}"
+        self.meta["next_run"] += 1
+        lexicon = {}
+        with open(self.run_file_path(run, "post"), 'wb') as f_obj:
+            offset = 0
+            for term in sorted(postings):
+                doc_ids = postings[term] if isinstance(postings[term], array) else array('I', postings[term])
+                f_obj.write(doc_ids.tobytes())
+                lexicon[term] = [offset, len(doc_ids)]
+                offset += len(doc_ids)
+        with open(self.run_file_path(run, "lex"), 'w', encoding='utf-8') as f_obj:
+            json.dump(lexicon, f_obj, ensure_ascii=False)
+        return run
+
+
+    def save_meta(self) -> None:
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f_obj:
+            json.dump(self.meta, f_obj)
+        os.replace(tmp_path, self.meta_path)
+
+
+    def flush_unlocked(self) -> None:
+        if not self.pending_docs:
+            return
+        logger.debug(f"flush comment index, docs={len(self.pending_docs)}, terms={len(self.pending_postings)}")
+        offset = self.docs_file.tell()
+        for key, doc in self.pending_docs:
+            line = (json.dumps(doc, ensure_ascii=False) + '\n').encode('utf-8')
+            self.offsets.append(offset)
+            self.offsets_file.write(array('Q', [offset]).tobytes())
+            self.docs_file.write(line)
+            self.keys_file.write((key or '') + '\n')
+            offset += len(line)
+        self.docs_file.flush()
+        self.offsets_file.flush()
+        self.keys_file.flush()
+
+        run = self.write_run(self.pending_postings)
+        self.meta["doc_count"] += len(self.pending_docs)
+        self.meta["runs"].append(run)
+        self.save_meta()
+        self.open_run(run)
+        self.pending_docs = []
+        self.pending_postings = defaultdict(list)
+
+        if len(self.meta["runs"]) > self.max_runs:
+            self.merge_unlocked()
+
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_unlocked()
+
+
+    def merge_unlocked(self) -> None:
+        '''merge all the runs into one, the runs hold increasing doc ids so the postings are concatenated'''
+        old_runs = list(self.meta["runs"])
+        logger.info(f"merge comment index runs={len(old_runs)}")
+        terms = set().union(*[self.runs[_][0] for _ in old_runs])
+        run = self.write_run({term: self.read_postings(term, old_runs) for term in terms})
+        self.meta["runs"] = [run]
+        self.save_meta()
+
+        for old_run in old_runs:
+            self.runs.pop(old_run)[1].close()
+            os.remove(self.run_file_path(old_run, "lex"))
+            os.remove(self.run_file_path(old_run, "post"))
+        self.open_run(run)
+        logger.info(f"merge comment index success, terms={len(terms)}")
+
+
+    def merge(self) -> None:
+        with self.lock:
+            self.flush_unlocked()
+            if len(self.meta["runs"]) > 1:
+                self.merge_unlocked()
+
+
+    def read_postings(self, term:str, runs:list[str]=None) -> array:
+        doc_ids = array('I')
+        for run in runs if runs else self.meta["runs"]:
+            lexicon, f_obj = self.runs[run]
+            if term in lexicon:
+                offset, count = lexicon[term]
+                f_obj.seek(offset * doc_ids.itemsize)
+                doc_ids.frombytes(f_obj.read(count * doc_ids.itemsize))
+        return doc_ids
+
+
+    def expand(self, token:str) -> set[str]:
+        '''a query token shorter than the bigrams matches the terms containing it'''
+        if isinstance(self.tokenizer, BigramTokenizer) and len(token) < self.tokenizer.n and CJK_RUN.fullmatch(token):
+            terms = {_ for lexicon, f_obj in self.runs.values() for _ in lexicon if token in _}
+            return terms | {_ for _ in self.pending_postings if token in _}
+        return {token}
+
+
+    def read_doc(self, doc_id:int) -> dict:
+        if doc_id >= self.meta["doc_count"]:
+            return self.pending_docs[doc_id - self.meta["doc_count"]][1]
+        self.docs_reader.seek(self.offsets[doc_id])
+        return json.loads(self.docs_reader.readline())
+
+
+    def search(self, query:str, limit:int=None, text_store:SegmentStore=None) -> list[Record]:
+        '''
+        the records containing every whitespace separated part of query.
+        the candidates are the intersection of the postings of the query tokens,
+        they are checked against the text because the bigrams do not keep the positions.
+        '''
+        parts = query.lower().split()
+        tokens = self.tokenizer.query(query)
+        if not tokens:
+            return []
+
+        with self.lock:
+            doc_ids = None
+            for token in tokens:
+                postings = set()
+                for term in self.expand(token):
+                    postings.update(self.read_postings(term))
+                    postings.update(self.pending_postings.get(term, ()))
+                doc_ids = postings if doc_ids is None else doc_ids & postings
+                if not doc_ids:
+                    return []
+            docs = [self.read_doc(_) for _ in sorted(doc_ids)]
+
+        results = []
+        for doc in docs:
+            record = RECORD_TYPES[doc["type"]].from_dict(doc)
+            if not self.store_text and text_store is not None:
+                record = text_store.get(self.record_key(record)) or record
+            text = getattr(record, self.text_field)
+            if text is not None and not all(_ in text.lower() for _ in parts):
+                continue
+            results.append(record)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+
+    def __len__(self) -> int:
+        return self.meta["doc_count"] + len(self.pending_docs)
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush_unlocked()
+            for lexicon, f_obj in self.runs.values():
+                f_obj.close()
+            for f_obj in (self.docs_file, self.offsets_file, self.keys_file, self.docs_reader):
+                f_obj.close()
+        logger.info(f'close comment index, docs={self.meta["doc_count"]}, runs={len(self.meta["runs"])}')
+
+
+    def __enter__(self) -> CommentIndex:
+        return self
+
+
+    def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
+        self.close()
+        return exc_type is None
+
+
+# the index of each crawler: directory under comment_index.path, text field, key fields, store_text
+INDEXES = {
+    "short": ("short_comment", "comment_text", ("cid",), True),
+    "long": ("long_comment", "comment", ("review_id",), False),
+}
+
+
+def open_comment_index(name:str) -> CommentIndex | None:
+    '''the index of a crawler when comment_index is enabled in the config'''
+    index_config = config.get("comment_index")
+    if not index_config or not index_config.get("enabled", False):
+        return None
+    directory, text_field, key_fields, store_text = INDEXES[name]
+    return CommentIndex(os.path.join(index_config["path"], directory), text_field, key_fields, store_text,
+                        tokenizer=index_config.get("tokenizer"),
+                        flush_docs=index_config.get("flush_docs", 10000),
+                        max_runs=index_config.get("max_runs", 8))
+
+
+if __name__ == "__main__":
+    config.load(sys.argv[3] if len(sys.argv) > 3 else None)
+    init_logger()
+    logger.setLevel(INFO)
+    name = sys.argv[2] if len(sys.argv) > 2 else "short"
+    index_config = config.get("comment_index")
+    directory, text_field, key_fields, store_text = INDEXES[name]
+    with CommentIndex(os.path.join(index_config["path"], directory), text_field, key_fields, store_text) as index:
+        if store_text:
+            records = index.search(sys.argv[1])
+        else:
+            with SegmentStore(config.get("long_comment")["save_path"]) as store:
+                records = index.search(sys.argv[1], text_store=store)
+    for record in records:
+        print(json.dumps(record.to_dict(), ensure_ascii=False))
+    print(len(records))
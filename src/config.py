@@ -1,11 +1,24 @@
+import os
 import json
 
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "config.json")
+
+
 class Config(object):
-    def __init__(self, path="../config.json") -> None:
-        with open(path, "r") as f:
+    '''the file is read by load(), or on the first get() if load() was not called'''
+    def __init__(self, path:str=None) -> None:
+        self.path = path if path else DEFAULT_CONFIG_PATH
+        self.config = None
+
+    def load(self, path:str=None) -> None:
+        if path:
+            self.path = path
+        with open(self.path, "r") as f:
             self.config = json.load(f)
 
     def get(self, query):
+        if self.config is None:
+            self.load()
         return self.config.get(query)
 
 config = Config()
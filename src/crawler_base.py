@@ -1,19 +1,26 @@
 from __future__ import annotations
 import os
+import sys
 import csv
 import json
-from typing import Callable
+from functools import partial
 from types import TracebackType
 from typing import Callable, Type, Optional
 from threading import Lock
 from logger import logger
 from config import config
 from async_scheduler import AsyncScheduler
+from records import Record, Task, RECORD_TYPES
+from paginator import Paginator
+from comment_index import open_comment_index
 
 
 class CrawlerBase:
-    def __init__(self, async_scheduler:AsyncScheduler, tasks:list[tuple[str, Callable[[str], None] | None]]=None, 
-                 save_path:str=None, file_name:str=None) -> None:
+    # intermediate record lists which are saved in the checkpoint of an interrupted run
+    checkpoint_fields: tuple[str, ...] = ()
+
+    def __init__(self, async_scheduler:AsyncScheduler, tasks:list[Task]=None, 
+                 save_path:str=None, file_name:str=None, weight:float=None, index_name:str=None) -> None:
         logger.debug("set save path")
         self.save_path = save_path if save_path else config.get("crawler_base")["default_save_path"]
         self.file_name = file_name if file_name else "crawler_base"
@@ -22,21 +29,35 @@ class CrawlerBase:
         self.failed_urls_path = config.get("crawler_base")["failed_urls_path"]
         self.failed_urls = []
         
-        logger.debug("get async scheduler")
+        logger.debug("get async scheduler and create job")
         self.async_scheduler = async_scheduler
+        # crawlers sharing the scheduler get workers in proportion to their weight
+        self.job = async_scheduler.create_job(self.__class__.__name__, weight if weight else 1)
 
         logger.debug("create url list and result list")
         self.tasks = tasks if tasks else []
         self.lock = Lock()
         self.results = []
 
+        logger.debug("set checkpoint path")
+        self.checkpoint_path = os.path.join(self.save_path, config.get("crawler_base").get("checkpoint_name", "checkpoint.json"))
+        self.phase = 0
+
+        logger.debug("create paginators")
+        self.page_window = config.get("crawler_base").get("page_window", 3)
+        self.paginators = {}
+
+        logger.debug("open comment index")
+        # None unless comment_index is enabled in the config
+        self.comment_index = open_comment_index(index_name) if index_name else None
+
     
     def __enter__(self) -> CrawlerBase:
         return self
     
 
     def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
-        self.async_scheduler.join()
+        self.join()
         if traceback:
             logger.error(f'exit error: [{exc_type}]{exc_value}\n{traceback}')
             print(traceback)
@@ -44,21 +65,156 @@ class CrawlerBase:
         return True
 
 
+    @staticmethod
+    def record_to_dict(record:Record | dict) -> dict:
+        return record.to_dict() if isinstance(record, Record) else record
+
+
     def start(self) -> None:
         logger.info(f"[{self.__class__.__name__}]start!")
         assert self.tasks and len(self.tasks) != 0, f"[{self.__class__.__name__}]tasks is None!"
-        self.async_scheduler.reset_progress_bar()
-        self.async_scheduler.add_tasks(self.tasks)
+        self.async_scheduler.reset_progress_bar(self.job)
+        self.async_scheduler.add_tasks(self.tasks, job=self.job)
         self.tasks = []
 
+
+    def join(self) -> None:
+        '''wait for the tasks of this crawler only'''
+        self.async_scheduler.join(self.job)
+
+
+    def index_records(self, records:list[Record]) -> None:
+        if self.comment_index:
+            self.comment_index.add_many(records)
+
+
+    def close_comment_index(self) -> None:
+        if self.comment_index:
+            self.comment_index.close()
+            self.comment_index = None
+
+
+    def submit_task(self, task:Task) -> None:
+        '''add a task while the crawler is running, e.g. from a handler'''
+        self.async_scheduler.add_task(task, job=self.job)
+
+
+    def paginate(self, key:str, make_task:Callable[[int], Task], page_size:int, max_pages:int,
+                 pending:list[tuple[int, Task]]=None) -> list[Task]:
+        '''create the paginator of one list, return the tasks of its first pages'''
+        paginator = Paginator(make_task, self.submit_task, page_size, max_pages, self.page_window,
+                              cancel=self.async_scheduler.cancel_task)
+        with self.lock:
+            self.paginators[key] = paginator
+        return paginator.first_tasks(pending)
+
+
+    def resume_tasks(self, tasks:list[Task]) -> list[Task]:
+        '''restore the state which belongs to the pending tasks of the checkpoint, e.g. paginators'''
+        return tasks
+
+
+    def resume_paginated_tasks(self, tasks:list[Task], handler:Callable, make_task:Callable[[Record, int], Task],
+                               page_size:int, max_pages:int) -> list[Task]:
+        '''recreate the paginators of the pending page tasks of handler, the record of a page task has id and page'''
+        pending = {}
+        for task in tasks:
+            if task.handler == handler:
+                pending.setdefault(task.record.id, []).append((task.record.page, task))
+
+        resumed = [_ for _ in tasks if _.handler != handler]
+        for pages in pending.values():
+            info = pages[0][1].record
+            resumed += self.paginate(info.id, partial(make_task, info), page_size, max_pages, pending=pages)
+        logger.debug(f"[{self.__class__.__name__}]resume {len(pending)} paginators")
+        return resumed
+
     
+    def run_phases(self, phases:list[Callable[[], list[Task]]]) -> None:
+        '''
+        generate and run the tasks of every phase, each phase is joined before the next one is generated.
+        an interrupted run saves a checkpoint and the next run resumes the pending tasks of that phase.
+        '''
+        resumed_tasks = self.load_checkpoint()
+        for i, generate in enumerate(phases):
+            if i < self.phase:
+                continue
+            tasks = self.resume_tasks(resumed_tasks) if resumed_tasks is not None else generate()
+            resumed_tasks = None
+            self.phase = i
+            if tasks:
+                self.crawler_add_tasks(tasks)
+                self.start()
+                self.join()
+
+            if self.async_scheduler.interrupted:
+                logger.warning(f"[{self.__class__.__name__}]interrupted at phase={i}")
+                self.save_checkpoint()
+                return
+
+        self.phase = len(phases)
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+    def save_checkpoint(self, path:str=None) -> None:
+        file_path = path if path else self.checkpoint_path
+        pending_tasks = self.async_scheduler.take_pending_tasks(owner=self) + self.tasks
+        logger.info(f"save [{self.__class__.__name__}] checkpoint at {file_path}, phase={self.phase}, pending={len(pending_tasks)}")
+
+        with self.lock:
+            checkpoint = {
+                "phase": self.phase,
+                "fields": {field: [[type(_).__name__, _.to_dict()] for _ in getattr(self, field)] for field in self.checkpoint_fields},
+                "pending": [{"url": _.url,
+                             "handler": _.handler.__name__ if _.handler else None,
+                             "record": [type(_.record).__name__, _.record.to_dict()] if _.record is not None else None,
+                             "until": _.until.__name__ if _.until else None,
+                             "parser": _.parser.__name__ if _.parser else None}
+                            for _ in pending_tasks]
+            }
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path + '.tmp', 'w', encoding='utf-8') as f_obj:
+            json.dump(checkpoint, f_obj, ensure_ascii=False)
+        os.replace(file_path + '.tmp', file_path)
+        logger.info(f"save [{self.__class__.__name__}] checkpoint success")
+
+
+    def load_checkpoint(self, path:str=None) -> list[Task] | None:
+        '''restore phase and intermediate results, return the pending tasks or None if there is no checkpoint'''
+        file_path = path if path else self.checkpoint_path
+        if not os.path.exists(file_path):
+            return None
+
+        logger.info(f"load [{self.__class__.__name__}] checkpoint from {file_path}")
+        with open(file_path, 'r', encoding='utf-8') as f_obj:
+            checkpoint = json.load(f_obj)
+
+        load_record = lambda item: RECORD_TYPES[item[0]].from_dict(item[1]) if item else None
+        module_vars = vars(sys.modules[self.__class__.__module__])
+        self.phase = checkpoint["phase"]
+        with self.lock:
+            for field, records in checkpoint["fields"].items():
+                setattr(self, field, [load_record(_) for _ in records])
+
+        tasks = [Task(_["url"],
+                      getattr(self, _["handler"]) if _["handler"] else None,
+                      load_record(_["record"]),
+                      until=module_vars[_["until"]] if _["until"] else None,
+                      parser=module_vars[_["parser"]] if _.get("parser") else None)
+                 for _ in checkpoint["pending"]]
+        logger.info(f"resume [{self.__class__.__name__}] from phase={self.phase}, pending={len(tasks)}")
+        return tasks
+
+
     def crawler_add_task(self, url:str, resp_handler:Callable[[str], None]=None) -> None:
         logger.debug(f"[{self.__class__.__name__}]crawler add task")
-        self.tasks.append(url, resp_handler)
+        self.tasks.append(Task(url, resp_handler))
         logger.debug(f"[{self.__class__.__name__}]add task success")
 
     
-    def crawler_add_tasks(self, tasks:list[tuple[str, Callable[[str], None] | None]]) -> None:
+    def crawler_add_tasks(self, tasks:list[Task]) -> None:
         logger.debug(f"[{self.__class__.__name__}]crawler add tasks")
         self.tasks += tasks
         logger.debug(f"[{self.__class__.__name__}]add {len(tasks)} tasks success")
@@ -91,7 +247,7 @@ class CrawlerBase:
         os.makedirs(self.save_path, exist_ok=True)
         with open(file_path, 'w', encoding='utf-8') as f_obj:
             for result in results:
-                f_obj.write(f'{json.dumps(result, ensure_ascii=False)}\n')
+                f_obj.write(f'{json.dumps(self.record_to_dict(result), ensure_ascii=False)}\n')
         
         logger.debug(f"save [{self.__class__.__name__}] results to [txt] success")
 
@@ -110,6 +266,6 @@ class CrawlerBase:
             writer = csv.DictWriter(f_obj, fieldnames=results[0].keys())
             writer.writeheader()
             for result in results:
-                writer.writerow(result)
+                writer.writerow(self.record_to_dict(result))
         
         logger.debug(f"save [{self.__class__.__name__}] results to [csv] success")
\ No newline at end of file
@@ -0,0 +1,136 @@
+from __future__ import annotations
+import threading
+from collections import deque
+from queue import Empty
+
+
+class Job:
+    '''
+    The tasks of one crawler on a shared scheduler.
+    join() only waits for the tasks of this job, weight is its share of the workers when several jobs have tasks.
+    '''
+
+    def __init__(self, name:str, weight:float, mutex:threading.Lock) -> None:
+        assert weight > 0, f"job={name} weight must be positive"
+        self.name = name
+        self.weight = weight
+        self.tasks = deque()
+        self.unfinished = 0
+        self.finished_count = 0
+        # virtual finish time of the last dispatched task
+        self.vtime = 0.0
+        self.all_tasks_done = threading.Condition(mutex)
+        self.progress_bar = None
+
+
+    def join(self) -> None:
+        with self.all_tasks_done:
+            while self.unfinished:
+                self.all_tasks_done.wait()
+
+
+    def __repr__(self) -> str:
+        return f'Job(name={self.name!r}, weight={self.weight}, queued={len(self.tasks)}, unfinished={self.unfinished})'
+
+
+class FairQueue:
+    '''
+    queue.Queue replacement with weighted fair queuing between jobs.
+    get() returns the task of the job with the smallest virtual time, every dispatch advances it by 1/weight,
+    so a job with weight 2 gets twice the workers of a job with weight 1 while both have tasks,
+    and one job alone gets all of them.
+    None (the stop sentinel) is returned only when no job has queued tasks.
+    '''
+
+    def __init__(self) -> None:
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.all_tasks_done = threading.Condition(self.mutex)
+        self.jobs = []
+        self.sentinels = deque()
+        self.unfinished = 0
+        self.vtime = 0.0
+        self.default_job = self.create_job("default")
+
+
+    def create_job(self, name:str, weight:float=1) -> Job:
+        job = Job(name, weight, self.mutex)
+        with self.mutex:
+            self.jobs.append(job)
+        return job
+
+
+    def put(self, item, job:Job=None) -> None:
+        with self.mutex:
+            if item is None:
+                self.sentinels.append(item)
+            else:
+                job = job if job else self.default_job
+                if not job.tasks:
+                    # an idle job does not save up credit
+                    job.vtime = max(job.vtime, self.vtime)
+                job.tasks.append(item)
+                job.unfinished += 1
+            self.unfinished += 1
+            self.not_empty.notify()
+
+
+    def _get(self):
+        active = [_ for _ in self.jobs if _.tasks]
+        if not active:
+            return self.sentinels.popleft()
+        job = min(active, key=lambda _: _.vtime)
+        self.vtime = job.vtime
+        job.vtime += 1 / job.weight
+        return job.tasks.popleft()
+
+
+    def get(self, block:bool=True, timeout:float=None):
+        with self.not_empty:
+            if not block:
+                if not self.qsize_unlocked():
+                    raise Empty
+            elif timeout is None:
+                while not self.qsize_unlocked():
+                    self.not_empty.wait()
+            elif not self.not_empty.wait_for(self.qsize_unlocked, timeout):
+                raise Empty
+            return self._get()
+
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+
+    def task_done(self, job:Job=None) -> None:
+        '''job of the finished task, None for the stop sentinel'''
+        with self.all_tasks_done:
+            if job:
+                job.unfinished -= 1
+                job.finished_count += 1
+                if job.unfinished <= 0:
+                    job.all_tasks_done.notify_all()
+            self.unfinished -= 1
+            if self.unfinished <= 0:
+                if self.unfinished < 0:
+                    raise ValueError('task_done() called too many times')
+                self.all_tasks_done.notify_all()
+
+
+    def join(self) -> None:
+        with self.all_tasks_done:
+            while self.unfinished:
+                self.all_tasks_done.wait()
+
+
+    def qsize_unlocked(self) -> int:
+        return sum(len(_.tasks) for _ in self.jobs) + len(self.sentinels)
+
+
+    def qsize(self) -> int:
+        with self.mutex:
+            return self.qsize_unlocked()
+
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
@@ -2,17 +2,22 @@ import datetime
 import logging
 from config import config
 
-current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-log_path = config.get("log_path")
-
 DEBUG = logging.DEBUG
 INFO = logging.INFO
 ERROR = logging.ERROR
 
-logging.basicConfig(
-    filename=f'{log_path}log_{current_time}.txt',
-    format = '%(asctime)s - %(levelname)s - %(funcName)s - %(message)s',
-)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(funcName)s - %(message)s'
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-logger.info("logger running...")
\ No newline at end of file
+
+
+def init_logger(log_path:str=None) -> None:
+    '''create the log file, nothing is written to disk before this is called'''
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_path = log_path if log_path else config.get("log_path")
+    logging.basicConfig(
+        filename=f'{log_path}log_{current_time}.txt',
+        format = LOG_FORMAT,
+    )
+    logger.info("logger running...")
@@ -8,11 +8,37 @@ from typing import Type, Optional
 from bs4 import BeautifulSoup as bs
 from crawler_base import CrawlerBase
 from async_scheduler import AsyncScheduler
+from records import MovieRecord, PageRecord, ReviewIdRecord, LongCommentRecord, Task
+from segment_store import SegmentStore
 from config import config
-from logger import logger, DEBUG
+from logger import logger, init_logger, DEBUG
+
+
+def parse_review_page(resp:str) -> list[tuple[str, str, str]]:
+    '''(review_id, star, ch_star) of the reviews on a review list page'''
+    soup = bs(resp, 'lxml')
+    reviews = []
+    for review in soup.select('.review-item'):
+        match = re.search(r'review_(\d+)_full', str(review))
+        review_id = match.group(1) if match else None
+
+        rating = review.select_one('.main-title-rating')
+        reviews.append((review_id,
+                        rating.get('class')[0] if rating else None,
+                        rating.get('title') if rating else None))
+    return reviews
+
+
+def parse_review(resp:str) -> str:
+    '''text of a full review'''
+    comment = json.loads(resp)['html']
+    soup = bs(comment, 'html.parser')
+    return soup.get_text()
 
 
 class LongCommentCrawler(CrawlerBase):
+    checkpoint_fields = ("full_comment_id_list",)
+
     def __init__(self, async_scheduler: AsyncScheduler) -> None:
         logger.info("init long comment crawler...")
 
@@ -24,16 +50,16 @@ class LongCommentCrawler(CrawlerBase):
         self.top250_path = self.long_comment_config["top250_path"]
         self.top250_txt_name = self.long_comment_config["top250_txt_name"]
         self.save_path = self.long_comment_config["save_path"]
+        self.block_size = self.long_comment_config.get("block_size", 256 * 1024)
+        self.segment_size = self.long_comment_config.get("segment_size", 64 * 1024 * 1024)
+        self.compression = self.long_comment_config.get("compression")
 
         logger.debug("generate tasks list")
-        # Visit the movie review page and get the total number of reviews
         # {"title": , "director": , "url": , "id": }
         self.top250_id_list = []
-        self.get_reviews_num_tasks = []
 
-        # Visit the movie review page to get the full review id
-        # {'title': title, 'id': id, 'comment_num': number_of_comments}
-        self.movie_review_page_num = []
+        # Visit the movie review pages until the last one to get the full review id
+        # {'title': title, 'id': id, 'page': page}
         self.movie_review_page_tasks = []
 
         # Get all comments by the full comment id
@@ -45,7 +71,9 @@ class LongCommentCrawler(CrawlerBase):
         self.long_comment_results = []
 
         super().__init__(async_scheduler,
-                         save_path=self.save_path)
+                         save_path=self.save_path,
+                         weight=self.long_comment_config.get("weight", 1),
+                         index_name="long")
 
         logger.info("init long comment crawler finish!")
 
@@ -55,8 +83,9 @@ class LongCommentCrawler(CrawlerBase):
 
 
     def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
-        self.async_scheduler.join()
+        self.join()
         self.save_full_comments()
+        self.close_comment_index()
         if traceback:
             logger.error(f'exit error: [{exc_type}]{exc_value}\n{traceback}')
             print(traceback)
@@ -66,24 +95,9 @@ class LongCommentCrawler(CrawlerBase):
 
     def start_and_join(self) -> None:
         logger.info("[LongCommentCrawler] start and join")
-        logger.debug("start get reviews num tasks")
-        self.read_top250_file()
-        self.crawler_add_tasks(self.get_reviews_num_tasks)
-        self.start()
-        self.async_scheduler.join()
-
-        logger.debug("start movie review page tasks")
-        self.generate_movie_all_page_tasks()
-        self.crawler_add_tasks(self.movie_review_page_tasks)
-        self.start()
-        self.async_scheduler.join()
-
-        logger.debug("start get full comment tasks")
-        self.generate_full_comment_tasks()
-        self.crawler_add_tasks(self.get_full_comment_tasks)
-        self.start()
-        self.async_scheduler.join()
-
+        # movie review page tasks -> get full comment tasks
+        self.run_phases([self.generate_movie_all_page_tasks,
+                         self.generate_full_comment_tasks])
         logger.info("finish all long comment tasks!")
 
 
@@ -93,100 +107,77 @@ class LongCommentCrawler(CrawlerBase):
                   'r', encoding='utf-8') as f_obj:
             for line in f_obj:
                 dict_line = json.loads(line.strip())
-                self.top250_id_list.append(dict_line)
-        
-        logger.debug("create get long comment ids tasks")
-        self.get_reviews_num_tasks = [(f'https://movie.douban.com/subject/{_["id"]}/reviews', 
-                                       partial(self.movie_page_handler, title=_["title"], id=_["id"])) 
-                                      for _ in self.top250_id_list]
+                self.top250_id_list.append(MovieRecord.from_dict(dict_line))
         logger.debug("process top250 file success")
 
     
-    def generate_movie_all_page_tasks(self) -> None:
-        logger.debug(f"generate all movie review pages, movie num={len(self.movie_review_page_num)}")
+    def generate_movie_all_page_tasks(self) -> list[Task]:
+        '''the first pages of every movie, the next ones are requested until a page is not full'''
+        self.read_top250_file()
+        logger.debug(f"generate all movie review pages, movie num={len(self.top250_id_list)}")
         self.movie_review_page_tasks = []
-        for info in self.movie_review_page_num:
-            tasks = [(f'https://movie.douban.com/subject/{info["id"]}/reviews?start={_ * self.one_page_review_num}', 
-                      partial(self.review_page_handler, title=info["title"])) 
-                     for _ in range(1, min(self.max_comment_page_num, -(-int(info["comment_num"]) // self.one_page_review_num)))]
-            self.movie_review_page_tasks += tasks
+        for movie in self.top250_id_list:
+            self.movie_review_page_tasks += self.paginate(movie.id, partial(self.make_review_page_task, movie),
+                                                          self.one_page_review_num, self.max_comment_page_num)
         logger.debug(f"generate all movie review pages success")
+        return self.movie_review_page_tasks
+
+
+    def make_review_page_task(self, movie:MovieRecord | PageRecord, page:int) -> Task:
+        return Task(f'https://movie.douban.com/subject/{movie.id}/reviews?start={page * self.one_page_review_num}',
+                    self.review_page_handler, PageRecord(movie.title, movie.id, page), parser=parse_review_page)
+
+
+    def resume_tasks(self, tasks:list[Task]) -> list[Task]:
+        return self.resume_paginated_tasks(tasks, self.review_page_handler, self.make_review_page_task,
+                                           self.one_page_review_num, self.max_comment_page_num)
 
     
-    def generate_full_comment_tasks(self) -> None:
+    def generate_full_comment_tasks(self) -> list[Task]:
         logger.debug(f"generate full comments, comments num={len(self.full_comment_id_list)}")
         self.get_full_comment_tasks = []
         for info in self.full_comment_id_list:
-            tasks = [(f'https://movie.douban.com/j/review/{info["review_id"]}/full',
-                     partial(self.review_handler, title=info["title"], review_id=info["review_id"], star=info["star"], ch_star=info["ch_star"]))]
-            self.get_full_comment_tasks += tasks
+            self.get_full_comment_tasks.append(Task(f'https://movie.douban.com/j/review/{info.review_id}/full',
+                                                    self.review_handler, info, parser=parse_review))
         logger.debug(f"generate full comments success")
+        return self.get_full_comment_tasks
 
 
-    def movie_page_handler(self, resp:str, title:str=None, id:str=None) -> None:
-        logger.debug("enter movie page handler")
-
-        soup = bs(resp, 'html.parser')
-        title_comments_match = re.search(r'(.*)的影评 \((\d+)\)', soup.title.string)
-        if title_comments_match:
-            number_of_comments = title_comments_match.group(2)
-        else:
-            number_of_comments = self.max_comment_page_num * self.one_page_review_num
-
-        with self.lock:
-            self.movie_review_page_num += [{'title': title, 'id': id, 'comment_num': number_of_comments}]
-        
-        logger.debug("movie page handler success")
-
-
-    def review_page_handler(self, resp:str, title:str=None) -> None:
-        '''get review id and star'''
+    def review_page_handler(self, reviews:list[tuple[str, str, str]], info:PageRecord) -> None:
+        '''get review id and star, a page with less than one_page_review_num reviews is the last one'''
         logger.debug("enter review page handler")
-
-        soup = bs(resp, 'lxml')
-        results = []
-        for review in soup.select('.review-item'):
-            result = {"title": title}
-            match = re.search(r'review_(\d+)_full', str(review))
-            if match:
-                review_id = match.group(1)
-                result["review_id"] = review_id
-
-            rating = review.select_one('.main-title-rating')
-            result["star"] = rating.get('class')[0] if rating else None
-            result["ch_star"] = rating.get('title') if rating else None
-            results.append(result)
-            # logger.debug(f"review page handler result: {results[-1]}")
+        results = [ReviewIdRecord(info.title, review_id, star, ch_star) for review_id, star, ch_star in reviews]
 
         with self.lock:
             self.full_comment_id_list += results
+        self.paginators[info.id].page_done(info.page, len(results))
 
         logger.debug("review page handler success")
 
 
-    def review_handler(self, resp:str, title:str=None, review_id:str=None, star:str=None, ch_star:str=None) -> None:
-        '''parse full comment'''
+    def review_handler(self, text:str, info:ReviewIdRecord) -> None:
+        '''save full comment'''
         logger.debug("enter review handler")
-        comment = json.loads(resp)['html']
-        soup = bs(comment, 'html.parser')
-        text = soup.get_text()
+        record = LongCommentRecord(info.title, info.review_id, info.star, info.ch_star, text)
         with self.lock:
-            self.long_comment_results += [{"title": title, "review_id": review_id, "star": star, "ch_star": ch_star, "comment": text}]
+            self.long_comment_results.append(record)
+        self.index_records([record])
         logger.debug("review handler success")
 
 
     def save_full_comments(self, path:str=None) -> None:
-        logger.info(f"save full comments at {path if path else self.save_path}, num={len(self.long_comment_results)}")
-        os.makedirs(self.save_path, exist_ok=True)
-        with self.lock:
+        '''append the comments to the segment store, texts already stored are not written again'''
+        path = path if path else self.save_path
+        logger.info(f"save full comments at {path}, num={len(self.long_comment_results)}")
+        new_texts = 0
+        with self.lock, SegmentStore(path, self.block_size, self.segment_size, self.compression) as store:
             for i in self.long_comment_results:
-                os.makedirs(os.path.join(self.save_path, i["title"]), exist_ok=True)
-                with open(os.path.join(self.save_path, i["title"], f"{i['review_id']}.txt"), 'w') as f_obj:
-                    json.dump(i, f_obj, ensure_ascii=False, indent=4)
-        logger.info("save full comments success!")
+                new_texts += store.put(i)
+        logger.info(f"save full comments success! new texts={new_texts}")
 
 
 if __name__ == "__main__":
+    init_logger()
     logger.setLevel(DEBUG)
     with AsyncScheduler() as scheduler:
         scheduler.start()
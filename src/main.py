@@ -1,27 +1,41 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from config import config
+from logger import init_logger
 from proxy_pool import ProxyPool
 from async_scheduler import AsyncScheduler
 from top250_crawler import Top250Crawler
 from long_comment_crawler import LongCommentCrawler
 from short_comment_crawler import ShortCommentCrawler
 
-def main():
+def main(config_path:str=None):
+    config.load(config_path)
+    init_logger()
+
     with ProxyPool() as proxy_pool:
         proxy_pool.update_all_proxies()
 
         with AsyncScheduler(proxy_pool) as scheduler:
+            scheduler.install_signal_handlers()
             scheduler.start()
             
             with Top250Crawler(scheduler) as crawler:
                 crawler.start()
 
-            with ShortCommentCrawler(scheduler) as crawler:
-                crawler.start_and_join()
+            if not scheduler.interrupted:
+                # both only need the top250 file, run them as two jobs sharing the workers
+                with ShortCommentCrawler(scheduler) as short_crawler, LongCommentCrawler(scheduler) as long_crawler, \
+                     ThreadPoolExecutor(max_workers=2) as executor:
+                    futures = [executor.submit(_.start_and_join) for _ in (short_crawler, long_crawler)]
+                    for future in futures:
+                        future.result()
 
-            with LongCommentCrawler(scheduler) as crawler:
-                crawler.start_and_join()
+    if scheduler.interrupted:
+        print("Interrupted! Checkpoints saved, run again to resume.")
+        sys.exit(128 + (scheduler.received_signal or 0))
 
     print("Done!")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(sys.argv[1] if len(sys.argv) > 1 else None)
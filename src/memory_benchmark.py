@@ -0,0 +1,99 @@
+'''
+Peak RSS of the long comment pipeline data, dict + functools.partial records vs __slots__ records + Task.
+
+No requests are sent: the benchmark rebuilds the structures LongCommentCrawler keeps alive during a full crawl
+(top250 list, review pages, review ids, full comment tasks and results) for a synthetic set of reviews.
+Every mode runs in a fresh process so that ru_maxrss is not shared.
+
+usage: python memory_benchmark.py [movies] [reviews_per_movie] [comment_length]
+'''
+from __future__ import annotations
+import sys
+import json
+import resource
+import subprocess
+from functools import partial
+from records import MovieRecord, CommentNumRecord, ReviewIdRecord, LongCommentRecord, Task
+
+
+class Handlers:
+    def movie_page_handler(self, resp:str, title:str=None, id:str=None) -> None: ...
+    def review_page_handler(self, resp:str, title:str=None) -> None: ...
+    def review_handler(self, resp:str, title:str=None, review_id:str=None, star:str=None, ch_star:str=None) -> None: ...
+
+
+def peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def parsed(value:str) -> str:
+    # a string taken from the parsed html of each review is a new object, even when the value repeats
+    return json.loads(json.dumps(value))
+
+
+def comment_text(i:int, length:int) -> str:
+    # distinct string per review, like the parsed html
+    return f'{i:08d}' + '很好看的电影' * (length // 6)
+
+
+def run_dict(movies:int, reviews:int, length:int) -> None:
+    handlers = Handlers()
+    # titles are parsed again for every row when read from json, so they are distinct objects
+    top250 = [json.loads(json.dumps({"title": f"电影{m}", "director": f"导演{m}", "url": f"https://movie.douban.com/subject/{m}/", "id": str(m)}))
+              for m in range(movies)]
+    get_reviews_num_tasks = [(f'https://movie.douban.com/subject/{_["id"]}/reviews',
+                              partial(handlers.movie_page_handler, title=_["title"], id=_["id"])) for _ in top250]
+    movie_review_page_num = [{'title': _["title"], 'id': _["id"], 'comment_num': reviews} for _ in top250]
+    # the title comes from the partial of the review page, one object per movie
+    full_comment_id_list = [{"title": _["title"], "review_id": str(m * reviews + r),
+                             "star": parsed("allstar50"), "ch_star": parsed("力荐")}
+                            for m, _ in enumerate(top250) for r in range(reviews)]
+    get_full_comment_tasks = [(f'https://movie.douban.com/j/review/{info["review_id"]}/full',
+                               partial(handlers.review_handler, title=info["title"], review_id=info["review_id"], star=info["star"], ch_star=info["ch_star"]))
+                              for info in full_comment_id_list]
+    long_comment_results = [{"title": info["title"], "review_id": info["review_id"], "star": info["star"], "ch_star": info["ch_star"],
+                             "comment": comment_text(i, length)}
+                            for i, info in enumerate(full_comment_id_list)]
+    print(json.dumps({"mode": "dict", "records": len(long_comment_results), "tasks": len(get_full_comment_tasks) + len(get_reviews_num_tasks),
+                      "movie_pages": len(movie_review_page_num), "peak_rss_kb": peak_rss_kb()}))
+
+
+def run_slots(movies:int, reviews:int, length:int) -> None:
+    handlers = Handlers()
+    top250 = [MovieRecord.from_dict(json.loads(json.dumps({"title": f"电影{m}", "director": f"导演{m}", "url": f"https://movie.douban.com/subject/{m}/", "id": str(m)})))
+              for m in range(movies)]
+    get_reviews_num_tasks = [Task(f'https://movie.douban.com/subject/{_.id}/reviews', handlers.movie_page_handler, _) for _ in top250]
+    movie_review_page_num = [CommentNumRecord(_.title, _.id, reviews) for _ in top250]
+    full_comment_id_list = [ReviewIdRecord(_.title, str(m * reviews + r), parsed("allstar50"), parsed("力荐"))
+                            for m, _ in enumerate(top250) for r in range(reviews)]
+    get_full_comment_tasks = [Task(f'https://movie.douban.com/j/review/{info.review_id}/full', handlers.review_handler, info)
+                              for info in full_comment_id_list]
+    long_comment_results = [LongCommentRecord(info.title, info.review_id, info.star, info.ch_star, comment_text(i, length))
+                            for i, info in enumerate(full_comment_id_list)]
+    print(json.dumps({"mode": "slots", "records": len(long_comment_results), "tasks": len(get_full_comment_tasks) + len(get_reviews_num_tasks),
+                      "movie_pages": len(movie_review_page_num), "peak_rss_kb": peak_rss_kb()}))
+
+
+MODES = {"dict": run_dict, "slots": run_slots}
+
+
+def main(argv:list[str]) -> None:
+    if len(argv) > 1 and argv[1] in MODES:
+        MODES[argv[1]](*map(int, argv[2:5]))
+        return
+
+    movies, reviews, length = (list(map(int, argv[1:4])) + [250, 2000, 600][len(argv[1:4]):])[:3]
+    baseline = peak_rss_kb()
+    print(f"movies={movies}, reviews_per_movie={reviews}, comment_length={length}, interpreter_rss_kb={baseline}")
+    results = {}
+    for mode in MODES:
+        out = subprocess.run([sys.executable, __file__, mode, str(movies), str(reviews), str(length)],
+                             capture_output=True, text=True, check=True).stdout
+        results[mode] = json.loads(out)
+        print(f'{mode:>6}: peak_rss={results[mode]["peak_rss_kb"] / 1024:.1f} MiB, records={results[mode]["records"]}')
+    print(f'saved: {(results["dict"]["peak_rss_kb"] - results["slots"]["peak_rss_kb"]) / 1024:.1f} MiB '
+          f'({1 - results["slots"]["peak_rss_kb"] / results["dict"]["peak_rss_kb"]:.1%})')
+
+
+if __name__ == "__main__":
+    main(sys.argv)
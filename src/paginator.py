@@ -0,0 +1,84 @@
+from __future__ import annotations
+import threading
+from functools import partial
+from typing import Callable
+from records import Task
+from logger import logger
+
+
+class Paginator:
+    '''
+    Fetch the pages of one list without knowing the number of pages.
+    At most window pages are requested ahead, every finished page requests the next one.
+    The first page with less than page_size items is the end of the list:
+    no more pages are requested and the pages after it are cancelled with cancel,
+    the queued ones and the ones whose request is running.
+    The page handler must call page_done(page, item_count).
+    A page which fails for good frees its place in the window through Task.on_failure,
+    it is not the end of the list: only a parsed page with less than page_size items is.
+    '''
+
+    def __init__(self, make_task:Callable[[int], Task], submit:Callable[[Task], None],
+                 page_size:int, max_pages:int, window:int, cancel:Callable[[Task], None]=None) -> None:
+        self.make_task = make_task
+        self.submit = submit
+        self.cancel = cancel if cancel else Task.cancel
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.window = max(1, window)
+
+        self.lock = threading.Lock()
+        self.next_page = 0
+        self.end_page = None
+        self.outstanding = {}
+
+
+    def fill_window(self) -> list[Task]:
+        '''called with the lock held, returns the new tasks to submit'''
+        tasks = []
+        while self.end_page is None and self.next_page < self.max_pages and len(self.outstanding) < self.window:
+            task = self.make_task(self.next_page)
+            task.on_failure = partial(self.page_failed, self.next_page)
+            self.outstanding[self.next_page] = task
+            tasks.append(task)
+            self.next_page += 1
+        return tasks
+
+
+    def first_tasks(self, pending:list[tuple[int, Task]]=None) -> list[Task]:
+        '''the first window of pages, or the pending (page, task) of an interrupted run'''
+        with self.lock:
+            if pending:
+                self.outstanding = dict(pending)
+                for page, task in pending:
+                    task.on_failure = partial(self.page_failed, page)
+                self.next_page = max(self.outstanding) + 1
+                return list(self.outstanding.values()) + self.fill_window()
+            return self.fill_window()
+
+
+    def page_done(self, page:int, item_count:int) -> None:
+        cancelled = []
+        with self.lock:
+            self.outstanding.pop(page, None)
+            if item_count < self.page_size and (self.end_page is None or page < self.end_page):
+                self.end_page = page
+                logger.debug(f"end of list at page={page}, item_count={item_count}")
+                cancelled = [self.outstanding.pop(_) for _ in sorted(self.outstanding) if _ > page]
+            tasks = self.fill_window()
+
+        for task in cancelled:
+            self.cancel(task)
+        for task in tasks:
+            self.submit(task)
+
+
+    def page_failed(self, page:int) -> None:
+        '''the request of page failed, request the next page in its place'''
+        with self.lock:
+            self.outstanding.pop(page, None)
+            logger.debug(f"page={page} failed, outstanding={sorted(self.outstanding)}")
+            tasks = self.fill_window()
+
+        for task in tasks:
+            self.submit(task)
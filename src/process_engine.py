@@ -0,0 +1,242 @@
+from __future__ import annotations
+import signal
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from typing import Any, Callable, TYPE_CHECKING
+from logger import logger
+
+if TYPE_CHECKING:
+    from records import Task
+    from async_scheduler import AsyncScheduler
+
+
+class ChildTask:
+    '''the task inside a worker process: the body is streamed with until and parsed with parser, the handler stays in the parent'''
+    __slots__ = ("until", "parser", "parsed")
+
+    def __init__(self, until:Callable[[str], bool]=None, parser:Callable[[str], Any]=None) -> None:
+        self.until = until
+        self.parser = parser
+        self.parsed = None
+
+
+    def __call__(self, resp:str) -> None:
+        self.parsed = self.parser(resp) if self.parser else resp
+
+
+    @property
+    def __name__(self) -> str:
+        return getattr(self.parser, '__name__', 'ChildTask')
+
+
+class ItemProxies:
+    '''
+    the proxies of one frontier item in a worker process, one per attempt, picked from the pool of the parent.
+    the errors are sent back with the result, only the parent counts them and replaces the proxies.
+    '''
+    __slots__ = ("proxies", "attempt", "errors")
+
+    def __init__(self, proxies:list[str]) -> None:
+        self.proxies = proxies
+        self.attempt = 0
+        self.errors = []
+
+
+    def get_one_proxy(self) -> str:
+        proxy = self.proxies[min(self.attempt, len(self.proxies) - 1)]
+        self.attempt += 1
+        return proxy
+
+
+    def proxy_error_cnt(self, proxy_ip:str) -> None:
+        self.errors.append(proxy_ip)
+
+
+async def child_worker(scheduler:AsyncScheduler, session, frontier:multiprocessing.Queue, results:multiprocessing.Queue) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await loop.run_in_executor(None, frontier.get)
+        if item is None:
+            break
+        task_id, url, until, parser, proxies = item
+        child_task = ChildTask(until, parser)
+        item_proxies = ItemProxies(proxies) if proxies else None
+        result = await scheduler.fetch(session, url, child_task, item_proxies)
+        results.put((task_id, result is not None, child_task.parsed, item_proxies.errors if item_proxies else None))
+
+
+async def child_main(scheduler:AsyncScheduler, frontier:multiprocessing.Queue, results:multiprocessing.Queue, concurrency:int) -> None:
+    async with scheduler.new_session() as session:
+        await asyncio.gather(*[child_worker(scheduler, session, frontier, results) for _ in range(concurrency)])
+
+
+def run_child(scheduler:AsyncScheduler, frontier:multiprocessing.Queue, results:multiprocessing.Queue, concurrency:int) -> None:
+    # the parent handles the signals and stops the children through the frontier
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # the copy of the proxy pool must not be used, every item brings its proxies
+    scheduler.proxy_pool = None
+    loop = scheduler.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(child_main(scheduler, frontier, results, concurrency))
+    finally:
+        loop.close()
+    logger.debug("exit worker process")
+
+
+class ProcessEngine:
+    '''
+    One event loop per worker process, so parsing runs in parallel instead of sharing one GIL.
+    A feeder thread moves the tasks from the scheduler queue (the shared frontier, with the fair scheduling
+    between jobs) to the processes; they fetch and parse, and a collector thread calls the handlers
+    in the parent with the parsed results. Needs the fork start method: the children use a copy of the scheduler.
+    '''
+
+    def __init__(self, scheduler:AsyncScheduler, num_processes:int, concurrency:int) -> None:
+        self.scheduler = scheduler
+        self.num_processes = num_processes
+        self.concurrency = concurrency
+
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count()
+        self.in_flight = {}
+        self.processes = []
+
+
+    def start(self) -> None:
+        logger.info(f"start process engine, processes={self.num_processes}, concurrency={self.concurrency}")
+        context = multiprocessing.get_context('fork')
+        # bounded, the tasks wait in the scheduler queue where jobs are scheduled fairly
+        self.frontier = context.Queue(maxsize=self.num_processes * self.concurrency)
+        self.results = context.Queue()
+        for _ in range(self.num_processes):
+            process = context.Process(target=run_child, args=(self.scheduler, self.frontier, self.results, self.concurrency), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.feeder.start()
+        self.collector.start()
+
+
+    def feed(self) -> None:
+        tasks_queue = self.scheduler.tasks_queue
+        while True:
+            task = tasks_queue.get()
+            if task is None:
+                tasks_queue.task_done()
+                break
+            if self.scheduler.interrupted:
+                self.scheduler.keep_pending(task)
+                tasks_queue.task_done(task.job)
+                continue
+            if task.cancelled:
+                self.scheduler.update_progress(task.job, fetched=False)
+                tasks_queue.task_done(task.job)
+                continue
+
+            task_id = next(self.task_ids)
+            with self.lock:
+                self.in_flight[task_id] = task
+            self.frontier.put((task_id, task.url, task.until, task.parser, self.pick_proxies()))
+
+        logger.debug("feeder send None to worker processes")
+        for _ in range(self.num_processes * self.concurrency):
+            self.frontier.put(None)
+
+
+    def pick_proxies(self) -> list[str] | None:
+        '''one proxy per attempt, the pool stays in this process'''
+        proxy_pool = self.scheduler.proxy_pool
+        if not proxy_pool:
+            return None
+        return [proxy_pool.get_one_proxy() for _ in range(self.scheduler.max_retries)]
+
+
+    def collect(self) -> None:
+        while True:
+            item = self.results.get()
+            if item is None:
+                break
+            task_id, success, parsed, proxy_errors = item
+            for proxy in proxy_errors or ():
+                try:
+                    self.scheduler.proxy_pool.proxy_error_cnt(proxy_ip=proxy)
+                except Exception as e:
+                    logger.error(f"proxy pool exception: {e}, proxy: {proxy}", exc_info=True)
+            with self.lock:
+                task = self.in_flight.pop(task_id, None)
+            if task is None:
+                # cancelled by shutdown() or cancel_task()
+                continue
+
+            try:
+                if not success:
+                    task.fail()
+                elif task.handler:
+                    try:
+                        task.handle(parsed)
+                    except Exception as e:
+                        logger.error(f"handler exception: {e}, url: {task.url}", exc_info=True)
+                        task.fail()
+            except Exception as e:
+                logger.error(f"on_failure exception: {e}, url: {task.url}", exc_info=True)
+            self.scheduler.update_progress(task.job, fetched=success)
+            self.scheduler.tasks_queue.task_done(task.job)
+
+
+    def in_flight_count(self) -> int:
+        with self.lock:
+            return len(self.in_flight)
+
+
+    def cancel_task(self, task:Task) -> None:
+        '''
+        the request already sent to a worker process cannot be stopped there,
+        the task is finished now and its late result is dropped
+        '''
+        with self.lock:
+            task_ids = [task_id for task_id, _ in self.in_flight.items() if _ is task]
+            for task_id in task_ids:
+                del self.in_flight[task_id]
+        if task_ids:
+            self.scheduler.update_progress(task.job, fetched=False)
+            self.scheduler.tasks_queue.task_done(task.job)
+
+
+    def cancel_in_flight(self) -> int:
+        '''give up the tasks sent to the processes, their late results are dropped'''
+        with self.lock:
+            tasks = list(self.in_flight.values())
+            self.in_flight.clear()
+        for task in tasks:
+            self.scheduler.keep_pending(task)
+            self.scheduler.tasks_queue.task_done(task.job)
+        return len(tasks)
+
+
+    def kill(self) -> None:
+        '''
+        before os._exit: it skips the atexit hook of multiprocessing which ends the daemon processes,
+        and they ignore SIGTERM and never see the end of the frontier, so they are killed
+        '''
+        logger.warning(f"kill {len(self.processes)} worker processes")
+        for process in self.processes:
+            if process.is_alive():
+                process.kill()
+        for process in self.processes:
+            process.join()
+
+
+    def stop(self) -> None:
+        logger.debug("stop process engine")
+        self.feeder.join()
+        for process in self.processes:
+            process.join()
+        self.results.put(None)
+        self.collector.join()
+        logger.debug("stop process engine success")
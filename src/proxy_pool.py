@@ -1,12 +1,13 @@
 from __future__ import annotations
-import requests
 import random
 from types import TracebackType
-from typing import Type, Optional
-import aiohttp
+from typing import Type, Optional, TYPE_CHECKING
 from config import config
 from logger import logger
 
+if TYPE_CHECKING:
+    import aiohttp
+
 
 class ProxyPool:
     '''If you are using another proxy pool api, you will need to refactor the intra-class functions'''
@@ -23,6 +24,7 @@ class ProxyPool:
         self.proxy_max_errors = self.proxy_api["proxy_max_errors"]
 
         logger.debug('set proxy auth')
+        import aiohttp
         self.__username = self.proxy_api["username"]
         self.__password = self.proxy_api["password"]
         self.__proxy_auth = aiohttp.BasicAuth(self.__username, self.__password)
@@ -47,6 +49,7 @@ class ProxyPool:
 
     def update_all_proxies(self) -> None:
         logger.info('update all proxies...')
+        import requests
         self.all_proxies = requests.get(
                 f'{self.proxy_api_ip}/?secret_id={self.__secret_Id}&signature={self.__signature}&num={self.proxy_num}&format=json'
             ).json().get('data').get('proxy_list')
@@ -56,6 +59,7 @@ class ProxyPool:
 
     def update_one_proxy(self) -> None:
         logger.debug('update one proxy')
+        import requests
         proxy = requests.get(
                 f'{self.proxy_api_ip}/?secret_id={self.SecretId}&signature={self.Signature}&num=1&format=json'
             ).json().get('data').get('proxy_list')[0]
@@ -0,0 +1,121 @@
+'''
+Post-crawl rating normalization and per-movie statistics.
+
+The crawler outputs are read in bulk into DataFrames, the rating css classes
+("allstar50", "allstar40 rating") become numeric stars with one vectorized regex,
+and the distribution and stats of every movie are computed together with a single np.bincount.
+
+usage: python rating_stats.py [config.json]
+'''
+from __future__ import annotations
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+from config import config
+from segment_store import SegmentStore
+from logger import logger, init_logger, INFO
+
+
+# 1 to 5 stars, 0 is the bin of the unrated comments
+MAX_STARS = 5
+STAR_PATTERN = r'allstar(\d+)'
+
+
+def iter_json_objects(text:str):
+    '''the objects of a file written by save_short_comments: indented json objects one after another'''
+    decoder = json.JSONDecoder()
+    index = 0
+    while True:
+        while index < len(text) and text[index].isspace():
+            index += 1
+        if index == len(text):
+            return
+        obj, index = decoder.raw_decode(text, index)
+        yield obj
+
+
+def read_short_comments(path:str) -> pd.DataFrame:
+    '''the {title}_{id}.txt files of save_short_comments, the checkpoint files in the same directory are skipped'''
+    logger.info(f"read short comments from {path}")
+    rows = []
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith(".txt"):
+            continue
+        with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f_obj:
+            rows.extend(iter_json_objects(f_obj.read()))
+    logger.info(f"read short comments success, num={len(rows)}")
+    return pd.DataFrame(rows, columns=["title", "id", "comment_text", "textual_rating", "complete_numeric_rating", "cid"])
+
+
+def read_long_comments(path:str, comments:bool=False) -> pd.DataFrame:
+    '''the segment store of the long comments, the texts are only decompressed when comments is True'''
+    logger.info(f"read long comments from {path}")
+    with SegmentStore(path) as store:
+        rows = [_.to_dict() for _ in store.records()] if comments else list(store.metadata())
+    logger.info(f"read long comments success, num={len(rows)}")
+    return pd.DataFrame(rows, columns=["title", "review_id", "star", "ch_star", "comment"])
+
+
+def normalize_ratings(ratings:pd.Series) -> pd.Series:
+    '''"allstar50" or "allstar40 rating" -> 5.0 or 4.0 stars, NaN when there is no rating'''
+    return ratings.astype("string").str.extract(STAR_PATTERN, expand=False).astype(float) / 10
+
+
+def rating_stats(df:pd.DataFrame, rating_column:str, key:str="title") -> pd.DataFrame:
+    '''
+    one row per movie: the number of comments with 0 (unrated) to 5 stars,
+    and count, rated, mean, std and median of the stars.
+    the movies are factorized once and all the counts come from one bincount over (movie, stars).
+    '''
+    # rows without a movie would get the code -1
+    df = df[df[key].notna()]
+    stars = normalize_ratings(df[rating_column])
+    codes, movies = pd.factorize(df[key], sort=True)
+    bins = np.rint(stars.fillna(0).to_numpy()).clip(0, MAX_STARS).astype(np.int64)
+    distribution = np.bincount(codes * (MAX_STARS + 1) + bins,
+                               minlength=len(movies) * (MAX_STARS + 1)).reshape(len(movies), MAX_STARS + 1)
+
+    values = np.arange(MAX_STARS + 1)
+    rated = distribution[:, 1:].sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (distribution * values).sum(axis=1) / rated
+        std = np.sqrt((distribution * values ** 2).sum(axis=1) / rated - mean ** 2)
+    # the median is the mean of the two middle stars, found where the cumulative counts reach them
+    cumulative = distribution[:, 1:].cumsum(axis=1)
+    lower = (cumulative >= ((rated + 1) // 2)[:, None]).argmax(axis=1) + 1
+    upper = (cumulative >= (rated // 2 + 1)[:, None]).argmax(axis=1) + 1
+    median = np.where(rated > 0, (lower + upper) / 2, np.nan)
+
+    stats = pd.DataFrame(distribution, index=pd.Index(movies, name=key),
+                         columns=["unrated"] + [f"star_{_}" for _ in range(1, MAX_STARS + 1)])
+    stats.insert(0, "count", distribution.sum(axis=1))
+    stats.insert(1, "rated", rated)
+    stats["mean"] = mean
+    stats["std"] = std
+    stats["median"] = median
+    return stats
+
+
+def main(argv:list[str]) -> None:
+    config.load(argv[1] if len(argv) > 1 else None)
+    init_logger()
+    logger.setLevel(INFO)
+    stats_config = config.get("rating_stats")
+    save_path = stats_config["save_path"]
+    os.makedirs(save_path, exist_ok=True)
+
+    short_comments = read_short_comments(stats_config.get("short_comment_path", config.get("short_comment")["save_path"]))
+    short_stats = rating_stats(short_comments, "complete_numeric_rating")
+    short_stats.to_csv(os.path.join(save_path, "short_comment_stats.csv"), encoding='utf-8')
+    logger.info(f"save short comment stats, movies={len(short_stats)}")
+
+    long_comments = read_long_comments(stats_config.get("long_comment_path", config.get("long_comment")["save_path"]))
+    long_stats = rating_stats(long_comments, "star")
+    long_stats.to_csv(os.path.join(save_path, "long_comment_stats.csv"), encoding='utf-8')
+    logger.info(f"save long comment stats, movies={len(long_stats)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
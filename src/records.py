@@ -0,0 +1,152 @@
+from __future__ import annotations
+import sys
+from typing import Any, Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fair_queue import Job
+
+
+def intern(value:Any) -> Any:
+    '''intern repeated strings (titles, ids, rating classes) so that records share one copy'''
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+    '''
+    Base class of the compact crawl records.
+    Subclasses only declare __slots__, the fields listed in __interned__ are interned on init.
+    '''
+    __slots__ = ()
+    __interned__ = ()
+
+    def __init__(self, *args, **kwargs) -> None:
+        values = dict(zip(self.__slots__, args))
+        values.update(kwargs)
+        for field in self.__slots__:
+            value = values.get(field)
+            setattr(self, field, intern(value) if field in self.__interned__ else value)
+
+
+    @classmethod
+    def from_dict(cls, data:dict) -> Record:
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+    def keys(self) -> tuple:
+        return self.__slots__
+
+
+    def __getitem__(self, key:str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+    def __eq__(self, other:object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+        return f'{self.__class__.__name__}({fields})'
+
+
+class MovieRecord(Record):
+    '''{"title": , "director": , "url": , "id": }'''
+    __slots__ = ("title", "director", "url", "id")
+    __interned__ = ("title", "director", "id")
+
+
+class CommentNumRecord(Record):
+    '''{'title': title, 'id': id, 'comment_num': number_of_comments}'''
+    __slots__ = ("title", "id", "comment_num")
+    __interned__ = ("title", "id")
+
+
+class PageRecord(Record):
+    '''{"title": title, "id": id, "page": page number of the list}'''
+    __slots__ = ("title", "id", "page")
+    __interned__ = ("title", "id")
+
+
+class ReviewIdRecord(Record):
+    '''{'title': title, "review_id": review_id, "star": , "ch_star": }'''
+    __slots__ = ("title", "review_id", "star", "ch_star")
+    __interned__ = ("title", "star", "ch_star")
+
+
+class LongCommentRecord(Record):
+    '''{"title": title, "review_id": review_id, "star": star, "ch_star": ch_star, "comment": text}'''
+    __slots__ = ("title", "review_id", "star", "ch_star", "comment")
+    __interned__ = ("title", "star", "ch_star")
+
+
+class ShortCommentRecord(Record):
+    '''{"title": title, "id":id, "comment_text": , "textual_rating": , "complete_numeric_rating": , "cid": data-cid of the comment}'''
+    __slots__ = ("title", "id", "comment_text", "textual_rating", "complete_numeric_rating", "cid")
+    __interned__ = ("title", "id", "textual_rating", "complete_numeric_rating")
+
+
+RECORD_TYPES = {cls.__name__: cls for cls in (MovieRecord, CommentNumRecord, PageRecord, ReviewIdRecord, LongCommentRecord, ShortCommentRecord)}
+
+
+class Task:
+    '''
+    A scheduled request: the url and the handler of the response.
+    The record is passed to the handler as the second argument, it replaces the functools.partial
+    which captured title, id, star... for every task.
+    until(window) is checked on the new text of every chunk while the body streams in (see read_body),
+    the download stops once it returns True.
+    parser(text) turns the body into what the handler gets, it must be a module level function:
+    with the process engine it runs in the worker process and only its result is sent back.
+    job is the scheduler job (crawler) the task belongs to, a cancelled task is skipped by the workers.
+    on_failure() is called when the request fails for good (retries used up, body too large),
+    before the url is saved to the failed urls.
+    '''
+    __slots__ = ("url", "handler", "record", "until", "parser", "job", "cancelled", "on_failure")
+
+    def __init__(self, url:str, handler:Callable[..., None]=None, record:Record=None,
+                 until:Callable[[str], bool]=None, parser:Callable[[str], Any]=None, job:Job=None) -> None:
+        self.url = url
+        self.handler = handler
+        self.record = record
+        self.until = until
+        self.parser = parser
+        self.job = job
+        self.cancelled = False
+        self.on_failure = None
+
+
+    def __call__(self, resp:str) -> None:
+        return self.handle(self.parser(resp) if self.parser else resp)
+
+
+    def handle(self, parsed:Any) -> None:
+        '''call the handler with the output of the parser'''
+        if self.record is None:
+            return self.handler(parsed)
+        return self.handler(parsed, self.record)
+
+
+    def fail(self) -> None:
+        if self.on_failure:
+            self.on_failure()
+
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+    @property
+    def __name__(self) -> str:
+        return getattr(self.handler, '__name__', repr(self.handler))
+
+
+    def __repr__(self) -> str:
+        return f'Task(url={self.url!r}, handler={self.__name__}, record={self.record!r})'
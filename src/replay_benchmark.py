@@ -0,0 +1,78 @@
+'''
+Handler and pipeline throughput on recorded traffic, no network.
+
+record an archive first by setting "record_path" in the scheduler config and running main.py, then
+usage: python replay_benchmark.py <archive> [top250|short|long] [replay_speed]
+replay_speed=0 (default) serves the responses as fast as possible, 1 with the recorded latency.
+the results, checkpoints, failed urls and comment index of the run go to a temporary directory,
+the real save paths are only read (top250_path of the comment crawlers).
+'''
+import os
+import sys
+import time
+import tempfile
+from config import config
+from logger import logger, init_logger, INFO
+from async_scheduler import AsyncScheduler
+from top250_crawler import Top250Crawler
+from long_comment_crawler import LongCommentCrawler
+from short_comment_crawler import ShortCommentCrawler
+
+
+def run_top250(scheduler:AsyncScheduler) -> None:
+    with Top250Crawler(scheduler) as crawler:
+        crawler.start()
+
+
+def run_short(scheduler:AsyncScheduler) -> None:
+    with ShortCommentCrawler(scheduler) as crawler:
+        crawler.start_and_join()
+
+
+def run_long(scheduler:AsyncScheduler) -> None:
+    with LongCommentCrawler(scheduler) as crawler:
+        crawler.start_and_join()
+
+
+CRAWLERS = {"top250": run_top250, "short": run_short, "long": run_long}
+
+
+def redirect_outputs(output_path:str) -> None:
+    '''point every path the crawlers write to into output_path, a benchmark must not touch the real results and checkpoints'''
+    scheduler_config = config.get("scheduler")
+    scheduler_config["failed_urls_path"] = os.path.join(output_path, "failed_urls.txt")
+    # recording while replaying would append to the archive
+    scheduler_config["record_path"] = None
+    base_config = config.get("crawler_base")
+    base_config["default_save_path"] = os.path.join(output_path, "crawler_base_out")
+    base_config["failed_urls_path"] = os.path.join(output_path, "failed_urls.txt")
+    for name in ("douban_top250", "long_comment", "short_comment"):
+        config.get(name)["save_path"] = os.path.join(output_path, name)
+    if config.get("comment_index"):
+        config.get("comment_index")["path"] = os.path.join(output_path, "comment_index")
+
+
+def main(argv:list[str]) -> None:
+    archive_path = argv[1]
+    crawler_name = argv[2] if len(argv) > 2 else "top250"
+    speed = float(argv[3]) if len(argv) > 3 else 0
+
+    config.load()
+    init_logger()
+    logger.setLevel(INFO)
+
+    with tempfile.TemporaryDirectory(prefix="replay_benchmark_") as output_path:
+        redirect_outputs(output_path)
+        with AsyncScheduler(replay_path=archive_path, replay_speed=speed) as scheduler:
+            scheduler.start()
+            start_time = time.perf_counter()
+            CRAWLERS[crawler_name](scheduler)
+            elapsed = time.perf_counter() - start_time
+            tasks = scheduler.fetched_count
+
+    print(f"crawler={crawler_name}, speed={speed}, urls={len(scheduler.archive)}, "
+          f"fetched={tasks}, time={elapsed:.3f}s, throughput={tasks / elapsed if elapsed else 0:.1f} tasks/s")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
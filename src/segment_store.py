@@ -0,0 +1,254 @@
+'''
+Append-only store of the long comments.
+
+The comment texts are deduplicated by content hash and appended to segment files in compressed blocks
+(zstd when zstandard is installed, gzip otherwise). Two append-only index files map
+content hash -> (segment, block offset, block size, position in the block) and
+review_id -> the other fields of the record and the content hash,
+so a review is read with one seek and the decompression of one block.
+
+    save_path/segments/segment_00000.bin   [codec, block size][compressed block]...
+    save_path/blobs.idx                    {"hash", "segment", "offset", "size", "start", "length"} per line
+    save_path/reviews.idx                  {"review_id", "title", "star", "ch_star", "hash"} per line
+
+import the files written by the old save_full_comments: python segment_store.py <old_path> [store_path]
+'''
+from __future__ import annotations
+import os
+import sys
+import gzip
+import json
+import struct
+import hashlib
+import threading
+import importlib.util
+from types import TracebackType
+from typing import Iterator, Type, Optional
+from records import LongCommentRecord
+from logger import logger, init_logger, INFO
+
+# block header: codec, compressed size
+BLOCK_HEAD = struct.Struct('>BI')
+GZIP, ZSTD = 0, 1
+CODECS = {"gzip": GZIP, "zstd": ZSTD}
+
+
+def content_hash(text:str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class SegmentStore:
+    def __init__(self, path:str, block_size:int=256 * 1024, segment_size:int=64 * 1024 * 1024, compression:str=None) -> None:
+        logger.info(f'open segment store at {path}')
+        self.path = path
+        self.segments_path = os.path.join(path, "segments")
+        self.block_size = block_size
+        self.segment_size = segment_size
+        if compression is None:
+            compression = "zstd" if importlib.util.find_spec('zstandard') else "gzip"
+        self.codec = CODECS[compression]
+        self.lock = threading.Lock()
+
+        os.makedirs(self.segments_path, exist_ok=True)
+        # hash -> (segment, offset, size, start, length), review_id -> {fields, "hash"}
+        self.blobs = {}
+        self.reviews = {}
+        self.load_index()
+
+        # the block being written: texts, their hashes and the reviews that wait for it
+        self.pending_texts = []
+        self.pending_size = 0
+        self.pending_blobs = {}
+        self.pending_reviews = []
+        self.segment = max([int(_[8:13]) for _ in os.listdir(self.segments_path) if _.startswith("segment_")], default=0)
+        self.segment_file = None
+        self.blobs_file = open(os.path.join(path, "blobs.idx"), 'a', encoding='utf-8')
+        self.reviews_file = open(os.path.join(path, "reviews.idx"), 'a', encoding='utf-8')
+
+        # the last decompressed block, reviews of a movie are usually read together
+        self.cached_block = (None, None)
+        logger.info(f'open segment store finish, reviews={len(self.reviews)}, blobs={len(self.blobs)}')
+
+
+    def load_index(self) -> None:
+        '''later lines win, a review fetched again points to its new text'''
+        blobs_path = os.path.join(self.path, "blobs.idx")
+        if os.path.exists(blobs_path):
+            with open(blobs_path, 'r', encoding='utf-8') as f_obj:
+                for line in f_obj:
+                    entry = json.loads(line)
+                    self.blobs[entry["hash"]] = (entry["segment"], entry["offset"], entry["size"], entry["start"], entry["length"])
+        reviews_path = os.path.join(self.path, "reviews.idx")
+        if os.path.exists(reviews_path):
+            with open(reviews_path, 'r', encoding='utf-8') as f_obj:
+                for line in f_obj:
+                    entry = json.loads(line)
+                    if entry["hash"] in self.blobs:
+                        self.reviews[entry["review_id"]] = entry
+
+
+    def segment_file_path(self, segment:int) -> str:
+        return os.path.join(self.segments_path, f"segment_{segment:05d}.bin")
+
+
+    def compress(self, data:bytes) -> bytes:
+        if self.codec == ZSTD:
+            import zstandard
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data)
+
+
+    @staticmethod
+    def decompress(codec:int, data:bytes) -> bytes:
+        if codec == ZSTD:
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+
+    def put(self, record:LongCommentRecord) -> bool:
+        '''add or replace a review, returns False when its text is already stored'''
+        text = record.comment if record.comment else ''
+        digest = content_hash(text)
+        entry = record.to_dict()
+        del entry["comment"]
+        entry["hash"] = digest
+
+        with self.lock:
+            stored = digest in self.blobs or digest in self.pending_blobs
+            if stored and self.reviews.get(entry["review_id"]) == entry:
+                # fetched again on a rerun, nothing changed
+                return False
+            if not stored:
+                data = text.encode('utf-8')
+                self.pending_blobs[digest] = (self.pending_size, len(data))
+                self.pending_texts.append(data)
+                self.pending_size += len(data)
+            self.pending_reviews.append(entry)
+            if self.pending_size >= self.block_size:
+                self.flush_block()
+        return not stored
+
+
+    def flush_block(self) -> None:
+        '''called with the lock held: write the pending block, then the index lines pointing to it'''
+        if self.pending_texts:
+            if self.segment_file is None:
+                self.segment_file = open(self.segment_file_path(self.segment), 'ab')
+            if self.segment_file.tell() >= self.segment_size:
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self.segment_file_path(self.segment), 'ab')
+
+            block = self.compress(b''.join(self.pending_texts))
+            offset = self.segment_file.tell()
+            self.segment_file.write(BLOCK_HEAD.pack(self.codec, len(block)))
+            self.segment_file.write(block)
+            self.segment_file.flush()
+            size = BLOCK_HEAD.size + len(block)
+
+            for digest, (start, length) in self.pending_blobs.items():
+                self.blobs[digest] = (self.segment, offset, size, start, length)
+                self.blobs_file.write(json.dumps({"hash": digest, "segment": self.segment, "offset": offset,
+                                                  "size": size, "start": start, "length": length}) + '\n')
+            self.blobs_file.flush()
+
+        for entry in self.pending_reviews:
+            self.reviews[entry["review_id"]] = entry
+            self.reviews_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.reviews_file.flush()
+
+        self.pending_texts = []
+        self.pending_size = 0
+        self.pending_blobs = {}
+        self.pending_reviews = []
+
+
+    def flush(self) -> None:
+        with self.lock:
+            self.flush_block()
+
+
+    def read_text(self, digest:str) -> str:
+        segment, offset, size, start, length = self.blobs[digest]
+        with self.lock:
+            key, block = self.cached_block
+            if key != (segment, offset):
+                if self.segment_file and segment == self.segment:
+                    self.segment_file.flush()
+                with open(self.segment_file_path(segment), 'rb') as f_obj:
+                    f_obj.seek(offset)
+                    data = f_obj.read(size)
+                codec, _ = BLOCK_HEAD.unpack_from(data)
+                block = self.decompress(codec, data[BLOCK_HEAD.size:])
+                self.cached_block = ((segment, offset), block)
+        return block[start:start + length].decode('utf-8')
+
+
+    def get(self, review_id:str) -> LongCommentRecord | None:
+        '''a review is visible after the block with its text is flushed'''
+        entry = self.reviews.get(review_id)
+        if entry is None:
+            return None
+        return LongCommentRecord(entry["title"], review_id, entry["star"], entry["ch_star"], self.read_text(entry["hash"]))
+
+
+    def metadata(self) -> Iterator[dict]:
+        '''the reviews without their texts, nothing is decompressed'''
+        for entry in list(self.reviews.values()):
+            yield {_: entry[_] for _ in LongCommentRecord.__slots__ if _ != "comment"}
+
+
+    def records(self) -> Iterator[LongCommentRecord]:
+        '''all the reviews in the order of the segments, every block is decompressed once'''
+        entries = sorted(self.reviews.values(), key=lambda _: self.blobs[_["hash"]])
+        for entry in entries:
+            yield self.get(entry["review_id"])
+
+
+    def __contains__(self, review_id:str) -> bool:
+        return review_id in self.reviews
+
+
+    def __len__(self) -> int:
+        return len(self.reviews)
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.flush_block()
+            if self.segment_file:
+                self.segment_file.close()
+            self.blobs_file.close()
+            self.reviews_file.close()
+        logger.info(f'close segment store, reviews={len(self.reviews)}, blobs={len(self.blobs)}')
+
+
+    def __enter__(self) -> SegmentStore:
+        return self
+
+
+    def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
+        self.close()
+        return exc_type is None
+
+
+def import_review_files(old_path:str, store:SegmentStore) -> int:
+    '''the save_path/<title>/<review_id>.txt files of the old save_full_comments'''
+    count = 0
+    for title in sorted(os.listdir(old_path)):
+        movie_path = os.path.join(old_path, title)
+        if not os.path.isdir(movie_path) or movie_path == store.segments_path:
+            continue
+        for file_name in os.listdir(movie_path):
+            with open(os.path.join(movie_path, file_name), 'r', encoding='utf-8') as f_obj:
+                store.put(LongCommentRecord.from_dict(json.load(f_obj)))
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    init_logger()
+    logger.setLevel(INFO)
+    with SegmentStore(sys.argv[2] if len(sys.argv) > 2 else sys.argv[1]) as store:
+        print(import_review_files(sys.argv[1], store))
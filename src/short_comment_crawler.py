@@ -7,8 +7,35 @@ from typing import Type, Optional
 from bs4 import BeautifulSoup as bs
 from crawler_base import CrawlerBase
 from async_scheduler import AsyncScheduler
+from records import MovieRecord, PageRecord, ShortCommentRecord, Task
 from config import config
-from logger import logger, DEBUG
+from logger import logger, init_logger, DEBUG
+
+
+def parse_short_comments(resp:str) -> list[tuple[str, str, str, str]]:
+    '''(comment_text, textual_rating, complete_numeric_rating, cid) of the comments on a page'''
+    soup = bs(resp, 'html.parser')
+    comments_and_ratings = []
+    for comment_section in soup.find_all('div', class_='comment-item'):
+        star_class = comment_section.find('span', class_=lambda x: x and x.startswith('allstar'))
+        complete_numeric_rating = None
+        if star_class:
+            class_name = star_class.get('class')
+            complete_numeric_rating = ' '.join(class_name)
+
+        star_rating = comment_section.find('span', class_='rating')
+        textual_rating = star_rating['title'] if star_rating and 'title' in star_rating.attrs else None
+        
+        comment = comment_section.find('p', class_='comment-content')
+        comment_text = comment.get_text(strip=True) if comment else ''
+
+        comments_and_ratings.append((comment_text, textual_rating, complete_numeric_rating, comment_section.get('data-cid')))
+    return comments_and_ratings
+
+
+def comments_end(window:str) -> bool:
+    '''the paginator follows the comment list, the rest of the page is not needed'''
+    return 'id="paginator"' in window
 
 
 class ShortCommentCrawler(CrawlerBase):
@@ -25,14 +52,11 @@ class ShortCommentCrawler(CrawlerBase):
         self.save_path = self.short_comment_config["save_path"]
 
         logger.debug("generate tasks list")
-        # Visit the movie review page and get the total number of reviews
         # {"title": , "director": , "url": , "id": }
         self.top250_id_list = []
-        self.get_reviews_num_tasks = []
 
-        # Visit the movie review page to get the short review
-        # {'title': title, 'id': id, 'comment_num': number_of_comments}
-        self.movie_review_num = []
+        # Visit the movie comment pages until the last one to get the short review
+        # {'title': title, 'id': id, 'page': page}
         self.movie_reviews_tasks = []
         
         # {"title": title, "id":id, 
@@ -41,7 +65,9 @@ class ShortCommentCrawler(CrawlerBase):
         self.short_comment_results = []
 
         super().__init__(async_scheduler,
-                         save_path=self.save_path)
+                         save_path=self.save_path,
+                         weight=self.short_comment_config.get("weight", 1),
+                         index_name="short")
         
         logger.info("init short comment crawler finish!")
 
@@ -51,8 +77,9 @@ class ShortCommentCrawler(CrawlerBase):
 
 
     def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
-        self.async_scheduler.join()
+        self.join()
         self.save_short_comments()
+        self.close_comment_index()
         if traceback:
             logger.error(f'exit error: [{exc_type}]{exc_value}\n{traceback}')
             print(traceback)
@@ -62,18 +89,7 @@ class ShortCommentCrawler(CrawlerBase):
 
     def start_and_join(self) -> None:
         logger.info("[ShortCommentCrawler] start and join")
-        logger.debug("start get reviews num tasks")
-        self.read_top250_file()
-        self.crawler_add_tasks(self.get_reviews_num_tasks)
-        self.start()
-        self.async_scheduler.join()
-
-        logger.debug("start get short comment tasks")
-        self.generate_short_comment_tasks()
-        self.crawler_add_tasks(self.movie_reviews_tasks)
-        self.start()
-        self.async_scheduler.join()
-
+        self.run_phases([self.generate_short_comment_tasks])
         logger.info("finish all short comment tasks!")
 
 
@@ -83,64 +99,42 @@ class ShortCommentCrawler(CrawlerBase):
                   'r', encoding='utf-8') as f_obj:
             for line in f_obj:
                 dict_line = json.loads(line.strip())
-                self.top250_id_list.append(dict_line)
-        
-        logger.debug("create get long comment ids tasks")
-        self.get_reviews_num_tasks = [(f'https://movie.douban.com/subject/{_["id"]}/comments?start=0&limit=1&status=P&sort=new_score', 
-                                       partial(self.movie_page_handler, title=_["title"], id=_["id"])) 
-                                      for _ in self.top250_id_list]
+                self.top250_id_list.append(MovieRecord.from_dict(dict_line))
         logger.debug("process top250 file success")
 
 
-    def generate_short_comment_tasks(self) -> None:
-        logger.debug(f"generate short comment tasks, movie num={len(self.movie_review_num)}")
+    def generate_short_comment_tasks(self) -> list[Task]:
+        '''the first pages of every movie, the next ones are requested until a page is not full'''
+        self.read_top250_file()
+        logger.debug(f"generate short comment tasks, movie num={len(self.top250_id_list)}")
         self.movie_reviews_tasks = []
-        for info in self.movie_review_num:
-            tasks = [(f'https://movie.douban.com/subject/{info["id"]}/comments?start={_ * self.one_page_review_num}&limit={self.one_page_review_num}&status=P&sort=new_score', 
-                      partial(self.short_comment_handler, title=info["title"], id=info["id"])) 
-                     for _ in range(1, min(self.max_comment_page_num, -(-int(info["comment_num"]) // self.one_page_review_num)))]
-            self.movie_reviews_tasks += tasks
+        for movie in self.top250_id_list:
+            self.movie_reviews_tasks += self.paginate(movie.id, partial(self.make_short_comment_task, movie),
+                                                      self.one_page_review_num, self.max_comment_page_num)
         logger.debug(f"generate short comment tasks")
+        return self.movie_reviews_tasks
 
-    
-    def movie_page_handler(self, resp:str, title:str=None, id:str=None) -> None:
-        logger.debug("enter movie page handler")
 
-        soup = bs(resp, 'html.parser')
-        watched_span = soup.find('span', string=lambda text: '看过' in text)
-        watched_count = 0
-        if watched_span:
-            watched_count = int(''.join(filter(str.isdigit, watched_span.get_text())))
+    def make_short_comment_task(self, movie:MovieRecord | PageRecord, page:int) -> Task:
+        return Task(f'https://movie.douban.com/subject/{movie.id}/comments?start={page * self.one_page_review_num}&limit={self.one_page_review_num}&status=P&sort=new_score',
+                    self.short_comment_handler, PageRecord(movie.title, movie.id, page),
+                    until=comments_end, parser=parse_short_comments)
 
-        with self.lock:
-            self.movie_review_num += [{"title": title, "id": id, "comment_num": watched_count}]
 
-        logger.debug("movie page handler success")
+    def resume_tasks(self, tasks:list[Task]) -> list[Task]:
+        return self.resume_paginated_tasks(tasks, self.short_comment_handler, self.make_short_comment_task,
+                                           self.one_page_review_num, self.max_comment_page_num)
 
     
-    def short_comment_handler(self, resp:str, title:str=None, id:str=None) -> None:
+    def short_comment_handler(self, comments:list[tuple[str, str, str, str]], info:PageRecord) -> None:
         logger.debug("enter short comment handler")
-        soup = bs(resp, 'html.parser')
-        comments_and_ratings = []
-        for comment_section in soup.find_all('div', class_='comment-item'):
-            star_class = comment_section.find('span', class_=lambda x: x and x.startswith('allstar'))
-            complete_numeric_rating = None
-            if star_class:
-                class_name = star_class.get('class')
-                complete_numeric_rating = ' '.join(class_name)
-
-            star_rating = comment_section.find('span', class_='rating')
-            textual_rating = star_rating['title'] if star_rating and 'title' in star_rating.attrs else None
-            
-            comment = comment_section.find('p', class_='comment-content')
-            comment_text = comment.get_text(strip=True) if comment else ''
-
-            comments_and_ratings.append({"title": title, "id":id, 
-                                         "comment_text": comment_text, 
-                                         "textual_rating": textual_rating, "complete_numeric_rating": complete_numeric_rating})
+        comments_and_ratings = [ShortCommentRecord(info.title, info.id, comment_text, textual_rating, complete_numeric_rating, cid)
+                                for comment_text, textual_rating, complete_numeric_rating, cid in comments]
             
         with self.lock:
             self.short_comment_results += comments_and_ratings
+        self.index_records(comments_and_ratings)
+        self.paginators[info.id].page_done(info.page, len(comments_and_ratings))
 
         logger.debug("short comment handler success")
 
@@ -150,14 +144,15 @@ class ShortCommentCrawler(CrawlerBase):
         os.makedirs(self.save_path, exist_ok=True)
         with self.lock:
             for i in self.short_comment_results:
-                with open(os.path.join(self.save_path, f"{i['title']}_{i['id']}.txt"), 'a') as f_obj:
-                    json.dump(i, f_obj, ensure_ascii=False, indent=4)
+                with open(os.path.join(self.save_path, f"{i.title}_{i.id}.txt"), 'a') as f_obj:
+                    json.dump(i.to_dict(), f_obj, ensure_ascii=False, indent=4)
                     f_obj.write('\n')
         logger.info("save short comments success!")
 
 
 
 if __name__ == "__main__":
+    init_logger()
     logger.setLevel(DEBUG)
     with AsyncScheduler() as scheduler:
         scheduler.start()
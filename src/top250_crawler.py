@@ -5,8 +5,28 @@ from typing import Type, Optional
 from bs4 import BeautifulSoup as bs
 from crawler_base import CrawlerBase
 from async_scheduler import AsyncScheduler
+from records import MovieRecord, Task
 from config import config
-from logger import logger
+from logger import logger, init_logger
+
+
+def parse_top250(resp:str) -> list[tuple[str, str, str, str]]:
+    '''(title, director, url, id) of the movies on a top250 page'''
+    soup = bs(resp, 'lxml')
+    movies = []
+    for item in soup.select('li .item'):
+        title = item.select_one('.title').text.strip()
+        director = item.select_one('.bd p').text.split('\xa0\xa0\xa0')[0].split(': ')[1].strip()
+        url = item.select_one('.hd a')['href'].strip()
+
+        match = re.search(r'/subject/(\d+)/', url)
+        if match:
+            id = match.group(1)
+        else:
+            id = None
+
+        movies.append((title, director, url, id))
+    return movies
 
 
 class Top250Crawler(CrawlerBase):
@@ -22,13 +42,14 @@ class Top250Crawler(CrawlerBase):
         self.file_name = self.top250_config["save_file_name"]
 
         logger.debug("generate tasks list")
-        self.top250_tasks = [(f'https://movie.douban.com/top250?start={_ * self.one_page_movie_num}', self.top250_handler) 
+        self.top250_tasks = [Task(f'https://movie.douban.com/top250?start={_ * self.one_page_movie_num}', self.top250_handler, parser=parse_top250) 
                                 for _ in range(-(-self.max_movies // self.one_page_movie_num))]
 
         super().__init__(async_scheduler,
                          tasks=self.top250_tasks,
                          save_path=self.save_path,
-                         file_name=self.file_name)
+                         file_name=self.file_name,
+                         weight=self.top250_config.get("weight", 1))
 
         logger.info("init top250 crawler finish!")
 
@@ -38,7 +59,7 @@ class Top250Crawler(CrawlerBase):
 
 
     def __exit__(self, exc_type: Type[Optional[BaseException]], exc_value: Optional[BaseException], traceback: Optional[TracebackType]) -> bool:
-        self.async_scheduler.join()
+        self.join()
         self.save_results_to_txt()
         if traceback:
             logger.error(f'exit error: [{exc_type}]{exc_value}\n{traceback}')
@@ -47,31 +68,21 @@ class Top250Crawler(CrawlerBase):
         return True
 
     
-    def top250_handler(self, resp:str) -> None:
+    def top250_handler(self, movies:list[tuple[str, str, str, str]]) -> None:
         logger.debug("enter top250 handler")
         with self.lock:
-            if resp is None:
+            if movies is None:
                 logger.warn('resp is None!', exc_info=True, stack_info=True)
                 return None
 
-            soup = bs(resp, 'lxml')
-            for item in soup.select('li .item'):
-                title = item.select_one('.title').text.strip()
-                director = item.select_one('.bd p').text.split('\xa0\xa0\xa0')[0].split(': ')[1].strip()
-                url = item.select_one('.hd a')['href'].strip()
-
-                match = re.search(r'/subject/(\d+)/', url)
-                if match:
-                    id = match.group(1)
-                else:
-                    id = None
-
-                self.results.append({'title': title, 'director': director, 'url': url, 'id': id})
+            for title, director, url, id in movies:
+                self.results.append(MovieRecord(title=title, director=director, url=url, id=id))
                 logger.debug(f"top250 handler result: {self.results[-1]}")
         logger.debug(f"top250 handler success")
 
 
 if __name__ == "__main__":
+    init_logger()
     with AsyncScheduler() as scheduler:
         scheduler.start()
         top250_crawler = Top250Crawler(scheduler)
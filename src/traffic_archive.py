@@ -0,0 +1,147 @@
+from __future__ import annotations
+import gzip
+import json
+import struct
+import asyncio
+import threading
+from collections import defaultdict
+from logger import logger
+
+# one entry: header length, body length, json header {"url", "status", "charset", "elapsed"}, raw body
+ENTRY_HEAD = struct.Struct('>II')
+
+
+class TrafficRecorder:
+    '''
+    append request/response pairs to a gzip archive, shared by all the worker threads.
+    every entry is a complete gzip member written at once, so the entries recorded before a crash stay readable.
+    '''
+
+    def __init__(self, path:str) -> None:
+        logger.info(f'record traffic to {path}')
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        self.count = 0
+
+
+    def record(self, url:str, status:int, charset:str, body:bytes, elapsed:float) -> None:
+        header = json.dumps({"url": url, "status": status, "charset": charset, "elapsed": round(elapsed, 4)},
+                            ensure_ascii=False).encode('utf-8')
+        member = gzip.compress(ENTRY_HEAD.pack(len(header), len(body)) + header + body)
+        with self.lock:
+            self.file.write(member)
+            self.file.flush()
+            self.count += 1
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+        logger.info(f'record traffic finish, entries={self.count}')
+
+
+class TrafficArchive:
+    '''recorded responses by url, a url recorded several times is served round-robin'''
+
+    def __init__(self, path:str) -> None:
+        logger.info(f'load traffic archive from {path}')
+        self.path = path
+        self.entries = defaultdict(list)
+        self.cursor = defaultdict(int)
+        self.lock = threading.Lock()
+
+        count = 0
+        with gzip.open(path, 'rb') as f_obj:
+            try:
+                while head := f_obj.read(ENTRY_HEAD.size):
+                    header_len, body_len = ENTRY_HEAD.unpack(head)
+                    header = f_obj.read(header_len)
+                    body = f_obj.read(body_len)
+                    if len(header) < header_len or len(body) < body_len:
+                        raise EOFError("entry cut")
+                    header = json.loads(header)
+                    header["body"] = body
+                    self.entries[header["url"]].append(header)
+                    count += 1
+            except (EOFError, struct.error, gzip.BadGzipFile) as e:
+                # the recording process was killed while writing the last entry
+                logger.warning(f'traffic archive is truncated after {count} entries: {e}')
+        logger.info(f'load traffic archive finish, urls={len(self.entries)}')
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def get(self, url:str) -> dict | None:
+        entries = self.entries.get(url)
+        if not entries:
+            return None
+        with self.lock:
+            i = self.cursor[url]
+            self.cursor[url] = i + 1
+        return entries[i % len(entries)]
+
+
+class ReplayContent:
+    def __init__(self, body:bytes) -> None:
+        self.body = body
+
+    async def iter_chunked(self, n:int):
+        for i in range(0, len(self.body), n):
+            yield self.body[i:i + n]
+
+
+class ReplayResponse:
+    '''the part of aiohttp.ClientResponse used by AsyncScheduler.fetch'''
+
+    def __init__(self, url:str, entry:dict | None, delay:float) -> None:
+        self.url = url
+        self.delay = delay
+        self.status = entry["status"] if entry else 404
+        self.charset = entry["charset"] if entry else None
+        body = entry["body"] if entry else b''
+        self.content_length = len(body)
+        self.content = ReplayContent(body)
+
+
+    def close(self) -> None:
+        pass
+
+
+    async def __aenter__(self) -> ReplayResponse:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        return self
+
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+
+class ReplaySession:
+    '''
+    replaces aiohttp.ClientSession in the workers, serves the responses of a TrafficArchive.
+    speed=1 replays with the recorded latency, speed=2 twice as fast, speed=0 as fast as possible.
+    '''
+
+    def __init__(self, archive:TrafficArchive, speed:float=0) -> None:
+        self.archive = archive
+        self.speed = speed
+
+
+    def get(self, url:str, **kwargs) -> ReplayResponse:
+        entry = self.archive.get(url)
+        if entry is None:
+            logger.warning(f'url={url} not in traffic archive')
+        delay = entry["elapsed"] / self.speed if entry and self.speed > 0 else 0
+        return ReplayResponse(url, entry, delay)
+
+
+    async def __aenter__(self) -> ReplaySession:
+        return self
+
+
+    async def __aexit__(self, *args) -> None:
+        pass